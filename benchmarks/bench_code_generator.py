@@ -0,0 +1,36 @@
+# coding: utf-8
+"""
+生成 serial_number 和验证码的耗时
+
+    SMSSERVER_CONFIG=conf.test python -m benchmarks.bench_code_generator
+"""
+import random
+import string
+import timeit
+
+from smsserver.utils.code_generator import CodeGenerator
+
+N = 100000
+
+
+def _random_choice():
+    """旧实现，不含数据库查重"""
+    serial_number = ''.join([random.choice(string.ascii_letters+string.digits) for i in range(16)])
+    code = ''.join([random.choice(string.digits) for i in range(6)])
+    return serial_number, code
+
+
+def main():
+    generator = CodeGenerator(pool_size=1000)
+    cases = [
+        ('random.choice', _random_choice),
+        ('CodeGenerator.generate_batch(1)', lambda: generator.generate_batch(1)),
+        ('CodeGenerator.get', generator.get),
+    ]
+    for name, func in cases:
+        seconds = timeit.timeit(func, number=N)
+        print('%-35s %8.2f us/code' % (name, seconds / N * 10**6))
+
+
+if __name__ == '__main__':
+    main()
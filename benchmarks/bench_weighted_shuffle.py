@@ -0,0 +1,68 @@
+# coding: utf-8
+"""
+打乱 provider 顺序的耗时
+
+    SMSSERVER_CONFIG=conf.test python -m benchmarks.bench_weighted_shuffle
+"""
+import random
+import timeit
+
+from smsserver.utils.weighted_shuffle import WeightedSampler, weighted_shuffle
+
+N = 100000
+
+
+class _Node(object):
+
+    def __init__(self, value=None, weight=None, left=None, right=None):
+        self.value = value
+        self.weight = weight
+        self.left = left
+        self.right = right
+
+
+def _tree(choices):
+    if not choices:
+        return None
+    if len(choices) == 1:
+        return _Node(*choices[0])
+    middle = len(choices) // 2
+    a, b = _tree(choices[:middle]), _tree(choices[middle:])
+    total = a.weight + b.weight
+    if random.uniform(0, total) < a.weight:
+        return _Node(None, total, left=a, right=b)
+    return _Node(None, total, left=b, right=a)
+
+
+def _flatten(tree):
+    if tree is None:
+        return []
+    if tree.left is None and tree.right is None:
+        return [tree.value]
+    return _flatten(tree.left) + _flatten(tree.right)
+
+
+def _tree_shuffle(choices):
+    """旧实现"""
+    random.shuffle(choices)
+    return _flatten(_tree(choices))
+
+
+def main():
+    for size in (3, 10, 50):
+        choices = [('provider%s' % i, random.randint(1, 100)) for i in range(size)]
+        sampler = WeightedSampler(choices)
+        cases = [
+            ('tree shuffle', lambda: _tree_shuffle(list(choices))),
+            ('weighted_shuffle', lambda: weighted_shuffle(choices)),
+            ('WeightedSampler.shuffle', sampler.shuffle),
+            ('WeightedSampler.choice', sampler.choice),
+        ]
+        print('%s choices' % size)
+        for name, func in cases:
+            seconds = timeit.timeit(func, number=N)
+            print('  %-30s %8.2f us' % (name, seconds / N * 10**6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# coding: utf-8
+"""
+端到端压测，服务商接口由 benchmarks.provider_simulator 模拟
+
+    SMSSERVER_CONFIG=conf.test python -m benchmarks.load_test message_send --rps 200 --duration 10
+    SMSSERVER_CONFIG=conf.test python -m benchmarks.load_test all --concurrency 50 --latency 0.1 --error-rate 0.05
+
+应用、模拟服务和压测客户端运行在同一个进程中，结果偏保守。
+需要可用的数据库，并且已经执行 script/create_table.py、script/create_sms_provider.py 和配置好服务地区。
+默认关闭 RATE_LIMITS，--keep-rate-limits 保留。
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import random
+import time
+
+import gevent
+import requests
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from benchmarks.provider_simulator import point_clients_to, start_simulator
+from smsserver import app
+from smsserver.bgtask import get_bgtasks_stats
+from smsserver.models import db
+from smsserver.views.viewlibs.decorator import compute_sign
+from conf import Config
+
+
+def _random_phone_number():
+    return '1%010d' % random.randint(0, 10**10 - 1)
+
+
+SCENARIOS = {
+    'message_send': ('message/send.json', lambda: {
+        'country_code': '86', 'phone_number': _random_phone_number(), 'text': u'压测短信', 'mode': 'async'}),
+    'message_send_sync': ('message/send.json', lambda: {
+        'country_code': '86', 'phone_number': _random_phone_number(), 'text': u'压测短信', 'mode': 'sync'}),
+    'verification_send': ('verification/send.json', lambda: {
+        'country_code': '86', 'phone_number': _random_phone_number(), 'mode': 'async'}),
+}
+
+
+class QueryCounter(object):
+    """统计 db.execute_sql 调用次数"""
+
+    def __init__(self):
+        self.count = 0
+        self._execute_sql = db.execute_sql
+
+    def install(self):
+        def execute_sql(*args, **kw):
+            self.count += 1
+            return self._execute_sql(*args, **kw)
+        db.execute_sql = execute_sql
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.status_counts = {}
+        self.max_queue_size = 0
+        self.start_time = self.end_time = None
+
+    def record(self, latency, status):
+        self.latencies.append(latency)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100.0))]
+
+
+def _request(session, url, params, stats):
+    params = dict(params, public_key=Config.PUBLIC_KEY)
+    params['signature'] = compute_sign(params, secret_key=Config.SECRET_KEY)
+    start = time.time()
+    try:
+        r = session.post(url, data=params, timeout=30)
+    except requests.exceptions.RequestException as e:
+        status = e.__class__.__name__
+    else:
+        try:
+            status = '%s %s' % (r.status_code, r.json().get('status'))
+        except ValueError:
+            status = str(r.status_code)
+    stats.record(time.time() - start, status)
+
+
+def _sample_queue_size(stats):
+    while True:
+        stats.max_queue_size = max(stats.max_queue_size, get_bgtasks_stats()['queue_size'])
+        gevent.sleep(0.1)
+
+
+def run_scenario(base_url, name, duration, rps=None, concurrency=None):
+    path, make_params = SCENARIOS[name]
+    url = '%s/api/v1/%s' % (base_url, path)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(concurrency or 0, 100)))
+    stats = Stats()
+    sampler = gevent.spawn(_sample_queue_size, stats)
+    stats.start_time = time.time()
+    deadline = stats.start_time + duration
+
+    if rps:
+        # 固定速率，不等待上一个请求返回
+        pool = Pool()
+        interval = 1.0 / rps
+        next_time = stats.start_time
+        while next_time < deadline:
+            pool.spawn(_request, session, url, make_params(), stats)
+            next_time += interval
+            gevent.sleep(max(0, next_time - time.time()))
+        pool.join()
+    else:
+        def _worker():
+            while time.time() < deadline:
+                _request(session, url, make_params(), stats)
+        gevent.joinall([gevent.spawn(_worker) for _ in range(concurrency)])
+
+    stats.end_time = time.time()
+    sampler.kill()
+    return stats
+
+
+def _wait_bgtasks_idle(timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        bgtasks_stats = get_bgtasks_stats()
+        if not bgtasks_stats['queue_size'] and not bgtasks_stats['active_worker_count']:
+            return
+        gevent.sleep(0.1)
+
+
+def report(name, stats, query_count, simulator_requests):
+    elapsed = stats.end_time - stats.start_time
+    total = len(stats.latencies)
+    print('== %s' % name)
+    print('  requests        %d in %.1fs, %.1f req/s' % (total, elapsed, total / elapsed))
+    print('  latency ms      p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % tuple(
+        stats.percentile(i) * 1000 for i in (50, 90, 99, 100)))
+    print('  status          %s' % ', '.join('%s: %d' % i for i in sorted(stats.status_counts.items())))
+    print('  bgtask queue    max %d' % stats.max_queue_size)
+    print('  db queries      %d, %.2f per request' % (query_count, query_count / float(total or 1)))
+    print('  provider calls  %d' % simulator_requests)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenario', choices=sorted(SCENARIOS) + ['all'])
+    parser.add_argument('--duration', type=float, default=10)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--rps', type=float)
+    group.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='模拟服务商平均响应时间(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务商返回错误的比例')
+    parser.add_argument('--keep-rate-limits', action='store_true')
+    args = parser.parse_args()
+
+    if not args.keep_rate_limits:
+        Config.RATE_LIMITS = {}
+    simulator, simulator_server = start_simulator(latency=args.latency, error_rate=args.error_rate)
+    point_clients_to('http://127.0.0.1:%s' % simulator_server.server_port)
+    app_server = WSGIServer(('127.0.0.1', 0), app, log=None)
+    app_server.start()
+    base_url = 'http://127.0.0.1:%s' % app_server.server_port
+
+    query_counter = QueryCounter()
+    query_counter.install()
+    names = sorted(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    for name in names:
+        query_count, simulator_requests = query_counter.count, simulator.request_count
+        stats = run_scenario(base_url, name, args.duration, rps=args.rps, concurrency=args.concurrency)
+        # 异步发送的后台任务也计入
+        _wait_bgtasks_idle()
+        report(name, stats, query_counter.count - query_count, simulator.request_count - simulator_requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# coding: utf-8
+"""
+本地模拟云片、大汉三通、阿里大于的 HTTP 接口，用于压测
+
+    python -m benchmarks.provider_simulator --port 9100 --latency 0.05 --error-rate 0.01
+
+latency 为平均响应时间(秒)，实际延迟按指数分布随机；error_rate 为返回业务错误的比例。
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import itertools
+import random
+import urlparse
+
+import gevent
+import simplejson
+from gevent.pywsgi import WSGIServer
+
+
+class ProviderSimulator(object):
+
+    def __init__(self, latency=0.05, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._ids = itertools.count(1)
+
+    def _sleep(self):
+        if self.latency > 0:
+            gevent.sleep(random.expovariate(1.0 / self.latency))
+
+    def _failed(self):
+        return random.random() < self.error_rate
+
+    def _yunpian_send(self, form):
+        if self._failed():
+            return {'code': 22, 'msg': u'验证码类短信1小时内同一手机号发送次数不能超过3次', 'detail': ''}
+        return {'code': 0, 'msg': 'OK', 'result': {'count': 1, 'fee': 1, 'sid': next(self._ids)}}
+
+    def _yunpian_batch_send(self, form):
+        data = []
+        for mobile in form.get('mobile', '').split(','):
+            if self._failed():
+                data.append({'code': 22, 'msg': 'failed', 'mobile': mobile, 'sid': 0})
+            else:
+                data.append({'code': 0, 'msg': u'发送成功', 'mobile': mobile, 'sid': next(self._ids)})
+        return {'total_count': len(data), 'data': data}
+
+    def _yunpian_pull_status(self, form):
+        return {'code': 0, 'msg': 'OK', 'sms_status': []}
+
+    def _dahansantong_submit(self, form):
+        if self._failed():
+            result, desc = 1, u'账号无效'
+        else:
+            result, desc = 0, u'提交成功'
+        return (u'<?xml version="1.0" encoding="UTF-8"?><response><msgid>%s</msgid>'
+                u'<result>%s</result><desc>%s</desc><blacklist></blacklist></response>'
+                % (next(self._ids), result, desc))
+
+    def _alidayu_rest(self, form):
+        if self._failed():
+            return {'error_response': {'code': 15, 'msg': 'Remote service error',
+                                       'sub_code': 'isv.BUSINESS_LIMIT_CONTROL', 'sub_msg': u'触发业务流控'}}
+        response_key = form.get('method', '').replace('.', '_') + '_response'
+        return {response_key: {'result': {'err_code': '0', 'model': '', 'success': True},
+                               'request_id': 'sim%s' % next(self._ids)}}
+
+    ROUTES = {
+        '/v1/sms/send.json': ('_yunpian_send', 'application/json'),
+        '/v1/sms/tpl_send.json': ('_yunpian_send', 'application/json'),
+        '/v2/sms/batch_send.json': ('_yunpian_batch_send', 'application/json'),
+        '/v1/sms/pull_status.json': ('_yunpian_pull_status', 'application/json'),
+        '/http/sms/Submit': ('_dahansantong_submit', 'text/xml'),
+        '/router/rest': ('_alidayu_rest', 'application/json'),
+    }
+
+    def __call__(self, environ, start_response):
+        self.request_count += 1
+        route = self.ROUTES.get(environ['PATH_INFO'])
+        if route is None:
+            # 连接池预热使用 HEAD /
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['']
+
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else ''
+        form = {k: v[0].decode('utf-8') for k, v in urlparse.parse_qs(body).items()}
+        self._sleep()
+
+        handler, content_type = route
+        ret = getattr(self, handler)(form)
+        if not isinstance(ret, basestring):
+            ret = simplejson.dumps(ret)
+        start_response('200 OK', [('Content-Type', '%s; charset=utf-8' % content_type)])
+        return [ret.encode('utf-8')]
+
+
+def start_simulator(port=0, latency=0.05, error_rate=0.0):
+    """在当前进程中启动，返回 (simulator, server)，server.server_port 为实际端口"""
+    simulator = ProviderSimulator(latency=latency, error_rate=error_rate)
+    server = WSGIServer(('127.0.0.1', port), simulator, log=None)
+    server.start()
+    return simulator, server
+
+
+def point_clients_to(base_url):
+    """把各服务商 client 的请求地址指向模拟服务"""
+    from smsserver.utils.provider import alidayu_client, dahansantong_client, yunpianv1_client
+    yunpianv1_client.DOMAIN = base_url
+    yunpianv1_client.BATCH_SEND_URL = base_url + '/v2/sms/batch_send.json'
+    yunpianv1_client.WARM_UP_URLS = (base_url,)
+    dahansantong_client.SEND_URL = base_url + '/http/sms/Submit'
+    dahansantong_client.WARM_UP_URLS = (base_url,)
+    alidayu_client.SEND_URL = base_url + '/router/rest'
+    alidayu_client.WARM_UP_URLS = (base_url,)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    simulator, server = start_simulator(args.port, args.latency, args.error_rate)
+    print('provider simulator listening on http://127.0.0.1:%s' % server.server_port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
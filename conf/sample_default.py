@@ -14,11 +14,74 @@ class DefaultConfig(object):
     DB_POOL_MAX_CONNECTIONS = 60
     DB_POOL_STALE_TIMEOUT = 300  # sec
 
+    # redis 配置
+    REDIS_URL = 'redis://localhost:6379/0'
+
     BGTASK_MAX_WORKERS = 20
+    # 后台任务队列, 可选 memory / redis / sqlite, redis 和 sqlite 会持久化任务
+    BGTASK_QUEUE_BACKEND = 'memory'
+    BGTASK_REDIS_URL = 'redis://localhost:6379/0'
+    BGTASK_SQLITE_PATH = '/tmp/smsserver_bgtask.db'
+    BGTASK_DEQUEUE_BATCH_SIZE = 20
+    BGTASK_LEASE_SECONDS = 60  # 取出后超过该时间未完成的任务会被重新投递
+    BGTASK_MAX_QUEUE_SIZE = 10000  # 队列超过该长度时拒绝新任务
+    BGTASK_MAX_QUEUE_AGE = 300  # sec, 排队超过该时间的任务不再执行, 与验证码有效期一致
+    # 任务通道, 每个通道单独排队, 按 weight 分配 worker, reserved_workers 个 worker 只给该通道使用
+    # MAX_QUEUE_SIZE 对每个通道单独生效
+    BGTASK_LANES = {
+        'interactive': {'weight': 8, 'reserved_workers': 5},  # 验证码等用户在等待的任务
+        'bulk': {'weight': 1, 'reserved_workers': 0},  # 群发、归档等
+    }
+    BGTASK_DEFAULT_LANE = 'bulk'
+    BGTASK_VERIFICATION_LANE = 'interactive'  # 异步发送验证码使用的通道
+
+    # 批量发送单次请求最多号码数
+    BATCH_SEND_MAX_RECIPIENTS = 10000
+
+    # /god/query 每页记录数
+    QUERY_PAGE_SIZE = 100
+
+    # 每个服务商共享的 HTTP 连接池, 同时请求数超过 SIZE 时等待
+    HTTP_POOL_SIZE = 20
+    HTTP_POOL_IDLE_TIMEOUT = 50  # sec, 小于服务商的 keep-alive 超时
+    HTTP_POOL_WARM_UP_SIZE = 2  # 启动时每个服务商预先建立的连接数
+
+    # 状态报告, 拉取到空后等待 PULL_INTERVAL 秒再拉, 收到的报告每 FLUSH_INTERVAL 秒批量写入
+    DELIVERY_REPORT_PULL_INTERVAL = 10  # sec
+    DELIVERY_REPORT_FLUSH_INTERVAL = 5  # sec
+    # 推送回调地址需要带上 ?token=xxx, 为空时不接收推送
+    DELIVERY_REPORT_CALLBACK_TOKEN = ''
+
+    # 服务商熔断配置, window 秒内请求数不少于 min_requests 且失败率达到 error_rate 时熔断
+    CIRCUIT_BREAKER_WINDOW = 60  # sec
+    CIRCUIT_BREAKER_MIN_REQUESTS = 10
+    CIRCUIT_BREAKER_ERROR_RATE = 0.5
+    CIRCUIT_BREAKER_OPEN_SECONDS = 30  # 熔断后经过该时间放行探测请求
+
+    # 同步发送的对冲配置, provider 超过最近耗时的 HEDGE_DELAY_PERCENTILE 分位数未返回时并发请求下一个
+    HEDGE_DELAY_PERCENTILE = 95
+    HEDGE_DEFAULT_DELAY = 1.0  # sec, 样本不足时使用
+    HEDGE_MIN_DELAY = 0.2  # sec
+    HEDGE_MAX_EXTRA_SENDS = 1  # 每个请求最多额外并发发送的次数
+
+    # 号码最近使用过的服务商记录, 可选 memory / redis, 多个进程共享时使用 redis
+    RECENT_PROVIDER_STORE = 'memory'
+    RECENT_PROVIDER_WINDOW = 1800  # sec
+
+    # 异步发送的 SMSRecord 延迟批量写入
+    RECORD_WRITE_BEHIND = True
+    RECORD_WRITER_BATCH_SIZE = 200
+    RECORD_WRITER_FLUSH_INTERVAL = 1  # sec
+
+    # 路由表缓存时间, 修改权重或服务地区时会主动失效
+    ROUTING_CACHE_TTL = 60  # sec
 
     # 验证码配置
     VERIFICATION_CODE_EXPIRE_MINUTES = 5
     VERIFY_TIMES_LIMIT = 10
+    VERIFICATION_CODE_POOL_SIZE = 1000  # 预先生成的 serial_number 和验证码数量
+    # 验证码存储, 可选 mysql / redis / memory, redis 和 memory 会异步归档到 mysql
+    VERIFICATION_STORE = 'mysql'
 
     # sentry 配置
     SENTRY_DSN = ''
@@ -27,6 +90,16 @@ class DefaultConfig(object):
     PUBLIC_KEY = ''  # 签名 public key
     SECRET_KEY = ''  # 签名 secret_key
 
+    # 限流配置, 可选 memory / redis
+    # RATE_LIMITS: {接口: {维度: (次数, 秒数)}}, 维度可选 phone / client / ip
+    RATE_LIMIT_BACKEND = 'memory'
+    RATE_LIMITS = {
+        'message_send': {'phone': (20, 3600), 'client': (2000, 1), 'ip': (600, 60)},
+        'message_batch_send': {'client': (10, 1), 'ip': (60, 60)},
+        'verification_send': {'phone': (5, 600), 'client': (2000, 1), 'ip': (600, 60)},
+        'verification_verify': {'phone': (30, 600), 'client': (2000, 1), 'ip': (600, 60)},
+    }
+
     # mako 配置
     MAKO_TRANSLATE_EXCEPTIONS = False
     MAKO_FILESYSTEM_CHECKS = True
@@ -66,5 +139,21 @@ class DefaultConfig(object):
         }
     }
 
+    # 按模板发送, text 为通用的文本格式, 其他 key 为各服务商的模板配置, 没有配置的服务商发送渲染后的文本
+    SMS_TEMPLATES = {
+        'verification_code': {
+            'text': u'验证码：%(code)s，请在%(minutes)s分钟内完成验证。',
+            # 'yunpian': {'tpl_id': 1},
+            # 'alidayu': {
+            #     'sms': {'template_code': '', 'params': ('code', 'minutes')},
+            #     'voice': {'template_code': '', 'params': ('code',), 'to_chinese': ('code',)},
+            # },
+        },
+        'verification_code_en': {
+            'text': u'Your confirmation code is %(code)s, please verify in %(minutes)s minutes.',
+        },
+    }
+
+    STATSD_ENABLED = True  # 为 False 时不发送任何打点
     STATSD_HOST = 'localhost'
     STATSD_PORT = 8125
@@ -4,4 +4,5 @@ from conf.default import DefaultConfig
 
 
 class Config(DefaultConfig):
-    pass
+    HTTP_POOL_WARM_UP_SIZE = 0
+    STATSD_ENABLED = False
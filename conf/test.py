@@ -0,0 +1,8 @@
+# coding: utf-8
+
+from conf.default import DefaultConfig
+
+
+class Config(DefaultConfig):
+    HTTP_POOL_WARM_UP_SIZE = 0
+    STATSD_ENABLED = False
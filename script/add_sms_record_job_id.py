@@ -0,0 +1,17 @@
+# coding: utf-8
+
+from playhouse.migrate import MySQLMigrator, migrate
+from smsserver.models import db
+from smsserver.models.sms_center import SMSRecord
+
+
+def main():
+    migrator = MySQLMigrator(db)
+    migrate(
+        migrator.add_column('sms_record', 'job_id', SMSRecord.job_id),
+        migrator.add_index('sms_record', ('job_id',), False),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# coding: utf-8
+
+from playhouse.migrate import MySQLMigrator, migrate
+from smsserver.models import db
+
+
+def main():
+    migrator = MySQLMigrator(db)
+    migrate(
+        migrator.add_index('sms_record', ('phone_number', 'create_time', 'id'), False),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+# coding: utf-8
+
+from playhouse.migrate import MySQLMigrator, migrate
+from smsserver.models import db
+
+
+def main():
+    # 执行前需确认 serial_number 没有重复数据
+    migrator = MySQLMigrator(db)
+    migrate(
+        migrator.drop_index('sms_verification', 'sms_verification_serial_number'),
+        migrator.add_index('sms_verification', ('serial_number',), True),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# coding: utf-8
+import sys
+import datetime
+
+from smsserver.models import db
+from smsserver.models.sms_stats import backfill
+
+
+def main(days):
+    # 按天回填到今天 0 点，今天的数据由进程内累加
+    end_time = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    for i in range(days, 0, -1):
+        start_time = end_time - datetime.timedelta(days=i)
+        with db.execution_context():
+            backfill(start_time, start_time + datetime.timedelta(days=1))
+        print('%s done' % start_time.date())
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
@@ -2,6 +2,7 @@
 
 from smsserver.models.sms_center import SMSProvider, SMSRecord, SMSProviderServiceArea
 from smsserver.models.sms_verification import SMSVerification
+from smsserver.models.sms_stats import SMSSendHourlyStat, SMSPhoneDailyStat
 
 
 def main():
@@ -9,6 +10,8 @@ def main():
     SMSRecord.create_table()
     SMSProviderServiceArea.create_table()
     SMSVerification.create_table()
+    SMSSendHourlyStat.create_table()
+    SMSPhoneDailyStat.create_table()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,21 @@
+# coding: utf-8
+from gevent import monkey
+monkey.patch_all()
+
+import logging
+
+import gevent
+from smsserver.models import db
+from smsserver.models.delivery_report import delivery_reports, spawn_delivery_report_pullers
+
+
+def main():
+    """只需要运行一个进程，推送的状态报告由 web 进程接收"""
+    logging.basicConfig(level=logging.INFO)
+    with db.execution_context(with_transaction=False):
+        pullers = spawn_delivery_report_pullers(delivery_reports)
+    gevent.joinall(pullers)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@
 from gevent import monkey
 monkey.patch_all()
 
+import gevent
 import logging
 import logging.config
 import simplejson
@@ -51,8 +52,14 @@ def register_mako(app):
     MakoTemplates(app)
 
 
+def register_http_pool(app):
+    if Config.HTTP_POOL_WARM_UP_SIZE > 0:
+        from smsserver.utils.provider import warm_up_clients
+        gevent.spawn(warm_up_clients, Config.HTTP_POOL_WARM_UP_SIZE)
+
+
 def register_statsd(app):
-    if not Config.DEBUG:
+    if not Config.DEBUG and Config.STATSD_ENABLED:
         FlaskStatsd(app=app, host=Config.STATSD_HOST, port=Config.STATSD_PORT)
 
 
@@ -66,3 +73,4 @@ register_logger(app)
 register_sentry(app)
 register_mako(app)
 register_statsd(app)
+register_http_pool(app)
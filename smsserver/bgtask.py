@@ -1,45 +1,239 @@
 # coding: utf-8
 
+import logging
+import time
 import uuid
+from collections import deque
+
 import gevent
+import redis
 
-from gevent.queue import Queue
+from gevent.event import Event
 from gevent.pool import Pool
 from conf import Config
 from smsserver.models import db
+from smsserver.utils import metrics
+from smsserver.utils.latency import LatencyTracker
+from smsserver.utils.task_queue import MemoryTaskQueue, RedisTaskQueue, SQLiteTaskQueue
+
+
+bgtask_logger = logging.getLogger('bgtask')
 
 
-bgtasks_queue = Queue()
+def _create_queue(lane):
+    # 默认通道沿用原来的 key 和表名，升级前未执行的任务不会丢失
+    if lane == Config.BGTASK_DEFAULT_LANE:
+        prefix, table = 'smsserver:bgtask', 'bgtask'
+    else:
+        prefix, table = 'smsserver:bgtask:%s' % lane, 'bgtask_%s' % lane
+    backend = Config.BGTASK_QUEUE_BACKEND
+    if backend == 'redis':
+        return RedisTaskQueue(redis.StrictRedis.from_url(Config.BGTASK_REDIS_URL), prefix=prefix,
+                              lease_seconds=Config.BGTASK_LEASE_SECONDS)
+    elif backend == 'sqlite':
+        return SQLiteTaskQueue(Config.BGTASK_SQLITE_PATH, lease_seconds=Config.BGTASK_LEASE_SECONDS, table=table)
+    return MemoryTaskQueue()
+
+
+class BGTaskQueueFull(Exception):
+    pass
 
 
 def spawn_bgtask(func, *args, **kw):
-    bgtasks_queue.put((uuid.uuid4().hex, func, args, kw))
+    """lane 指定任务通道，见 Config.BGTASK_LANES，不会传给 func"""
+    lane = kw.pop('lane', None) or Config.BGTASK_DEFAULT_LANE
+    manager.put(lane, (uuid.uuid4().hex, func, args, kw, time.time()))
+
+
+class BGTaskLane(object):
+    """
+    一个任务通道
+
+    buffer 中是已从 queue 取出(持有租约)、等待分配 worker 的任务。
+    vtime 为加权公平队列的虚拟时间，每分配一个任务增加 1 / weight。
+    """
+
+    def __init__(self, name, queue, weight=1, reserved_workers=0):
+        self.name = name
+        self.queue = queue
+        self.weight = weight
+        self.reserved_workers = reserved_workers
+        self.buffer = deque()
+        self.vtime = 0.0
+        self.active_count = 0
+        self.rejected_count = 0
+        self.expired_count = 0
+
+    def qsize(self):
+        return self.queue.qsize() + len(self.buffer)
 
 
 class BGTaskManager(object):
+    """
+    按通道调度后台任务
+
+    有空闲 worker 时在有任务的通道中选 vtime 最小的执行(加权公平队列)，
+    其他通道未用满的 reserved_workers 不会分给当前通道。
+    """
 
-    def __init__(self, max_workers):
+    def __init__(self, max_workers, lanes, batch_size=1, recover_interval=10,
+                 max_queue_size=10000, max_queue_age=300, idle_timeout=1):
         self.max_workers = max_workers
+        self.lanes = lanes
+        self.batch_size = batch_size
+        self.recover_interval = recover_interval
+        self.max_queue_size = max_queue_size
+        self.max_queue_age = max_queue_age
+        self.idle_timeout = idle_timeout
+        self.queue_wait = LatencyTracker()
+        self._lanes = {lane.name: lane for lane in lanes}
+        self._vtime = 0.0
+        self._wakeup = Event()
         self._pool = Pool(size=max_workers)
 
+    @property
+    def rejected_count(self):
+        return sum(lane.rejected_count for lane in self.lanes)
+
+    @property
+    def expired_count(self):
+        return sum(lane.expired_count for lane in self.lanes)
+
+    def put(self, lane_name, task):
+        lane = self._lanes[lane_name]
+        if lane.queue.qsize() >= self.max_queue_size:
+            lane.rejected_count += 1
+            metrics.incr('bgtask.rejected', func=task[1].__name__, lane=lane.name)
+            raise BGTaskQueueFull
+        lane.queue.put(task)
+        self._wakeup.set()
+
     def run(self):
+        # 重启后把上次未 ack 的任务放回队列
+        self._recover()
+        last_recover_time = time.time()
         while True:
-            task_id, func, args, kw = bgtasks_queue.get()
-            # 为每个任务创建单独的 execution context 避免数据库连接无法正常回收
-            # http://docs.peewee-orm.com/en/latest/peewee/database.html#advanced-connection-management
-            func = db.execution_context(with_transaction=False)(func)
-            self._pool.spawn(func, *args, **kw)
+            if time.time() - last_recover_time >= self.recover_interval:
+                self._recover()
+                last_recover_time = time.time()
+
+            # 新任务入队或有 worker 结束时唤醒，其他进程写入 redis/sqlite 的任务最多等待 idle_timeout
+            self._wakeup.clear()
+            self._fill_buffers()
+            if not self._dispatch():
+                self._wakeup.wait(timeout=self.idle_timeout)
+
+    def _recover(self):
+        for lane in self.lanes:
+            try:
+                count = lane.queue.recover()
+            except Exception:
+                bgtask_logger.exception('bgtask_recover_failed,%s' % lane.name)
+                continue
+            if count:
+                bgtask_logger.warning('bgtask_recovered,%s %s' % (lane.name, count))
+
+    def _fill_buffers(self):
+        for lane in self.lanes:
+            if lane.buffer:
+                continue
+            try:
+                tasks = lane.queue.get_batch(self.batch_size, timeout=0)
+            except Exception:
+                bgtask_logger.exception('bgtask_dequeue_failed,%s' % lane.name)
+                gevent.sleep(1)
+                continue
+            if tasks:
+                # 空闲过的通道不能积攒 vtime
+                lane.vtime = max(lane.vtime, self._vtime)
+                lane.buffer.extend(tasks)
+
+    def _can_start(self, lane):
+        reserved = sum(max(0, i.reserved_workers - i.active_count) for i in self.lanes if i is not lane)
+        return self.active_worker_count() + reserved < self.max_workers
+
+    def _pick_lane(self):
+        lanes = [i for i in self.lanes if i.buffer and self._can_start(i)]
+        if not lanes:
+            return None
+        return min(lanes, key=lambda i: (i.vtime, -i.weight))
+
+    def _dispatch(self):
+        """把 buffer 中的任务分配给空闲 worker，返回分配的任务数"""
+        count = 0
+        while self._pool.free_count():
+            lane = self._pick_lane()
+            if lane is None:
+                break
+            self._vtime = lane.vtime
+            lane.vtime += 1.0 / lane.weight
+            lane.active_count += 1
+            self._pool.spawn(self._execute, lane, *lane.buffer.popleft())
+            count += 1
+        return count
+
+    def _execute(self, lane, task_id, func, args, kw, enqueue_time):
+        try:
+            self._execute_task(lane, task_id, func, args, kw, enqueue_time)
+        finally:
+            lane.active_count -= 1
+            self._wakeup.set()
+
+    def _execute_task(self, lane, task_id, func, args, kw, enqueue_time):
+        queue_wait = time.time() - enqueue_time
+        self.queue_wait.record(lane.name, queue_wait)
+        metrics.timing('bgtask.queue_wait', queue_wait * 1000, func=func.__name__, lane=lane.name)
+        # 排队太久的任务直接丢弃，验证码过期后再发出去没有意义
+        if queue_wait > self.max_queue_age:
+            lane.expired_count += 1
+            metrics.incr('bgtask.expired', func=func.__name__, lane=lane.name)
+            bgtask_logger.warning('bgtask_expired,%s' % task_id)
+            lane.queue.ack(task_id)
+            return
+
+        # 为每个任务创建单独的 execution context 避免数据库连接无法正常回收
+        # http://docs.peewee-orm.com/en/latest/peewee/database.html#advanced-connection-management
+        try:
+            with metrics.timer('bgtask.execute', func=func.__name__, lane=lane.name):
+                db.execution_context(with_transaction=False)(func)(*args, **kw)
+        except Exception:
+            bgtask_logger.exception('bgtask_failed,%s' % task_id)
+        finally:
+            lane.queue.ack(task_id)
 
     def active_worker_count(self):
         return self._pool.size - self._pool.free_count()
 
+    def get_lane_stats(self, lane):
+        d = {'weight': lane.weight,
+             'reserved_workers': lane.reserved_workers,
+             'active_worker_count': lane.active_count,
+             'queue_size': lane.qsize(),
+             'rejected_count': lane.rejected_count,
+             'expired_count': lane.expired_count}
+        for percent in (50, 99):
+            # 最近 200 个任务的排队时间(秒)
+            d['queue_wait_p%s' % percent] = self.queue_wait.percentile(lane.name, percent, min_samples=1)
+        return d
+
 
-manager = BGTaskManager(Config.BGTASK_MAX_WORKERS)
+manager = BGTaskManager(Config.BGTASK_MAX_WORKERS,
+                        [BGTaskLane(name, _create_queue(name), **options)
+                         for name, options in sorted(Config.BGTASK_LANES.items())],
+                        batch_size=Config.BGTASK_DEQUEUE_BATCH_SIZE,
+                        recover_interval=Config.BGTASK_LEASE_SECONDS / 2,
+                        max_queue_size=Config.BGTASK_MAX_QUEUE_SIZE,
+                        max_queue_age=Config.BGTASK_MAX_QUEUE_AGE)
 gevent.spawn(manager.run)
 
 
 def get_bgtasks_stats():
+    lanes = {lane.name: manager.get_lane_stats(lane) for lane in manager.lanes}
     d = {'size': manager.max_workers,
          'active_worker_count': manager.active_worker_count(),
-         'queue_size': bgtasks_queue.qsize()}
+         'queue_size': sum(i['queue_size'] for i in lanes.values()),
+         'max_queue_size': manager.max_queue_size,
+         'rejected_count': manager.rejected_count,
+         'expired_count': manager.expired_count,
+         'lanes': lanes}
     return d
@@ -12,6 +12,12 @@ class SMSSendStatus(object):
     failed = 2
 
 
+class SMSDeliveryStatus(object):
+    unknown = 0
+    delivered = 1
+    failed = 2
+
+
 class SMSProviderIdent(object):
     yunpian = 1
     dahansantong = 2
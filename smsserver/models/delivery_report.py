@@ -0,0 +1,158 @@
+# coding: utf-8
+import atexit
+import datetime
+import logging
+import time
+
+import gevent
+from playhouse.shortcuts import case
+from smsserver.models import db
+from smsserver.models.const import SMSDeliveryStatus
+from smsserver.models.sms_center import SMSProvider, SMSRecord
+from smsserver.utils import metrics
+from conf import Config
+
+delivery_report_logger = logging.getLogger('delivery_report')
+
+_REPORT_STATUS = {
+    'SUCCESS': SMSDeliveryStatus.delivered,
+    'FAIL': SMSDeliveryStatus.failed,
+}
+
+
+def _parse_receive_time(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_delivery_reports(provider_id, reports, chunk_size=500):
+    """
+    按 outid 批量更新 SMSRecord 的 delivery_status 和 receive_time
+
+    reports: {outid: {'status': SMSDeliveryStatus, 'receive_time': datetime, 'error_msg': ''}}
+    返回值: 更新的行数
+    """
+    items = reports.items()
+    updated = 0
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i+chunk_size]
+        fields = {
+            'delivery_status': case(SMSRecord.outid, [(k, v['status']) for k, v in chunk]),
+            'receive_time': case(SMSRecord.outid, [(k, v['receive_time']) for k, v in chunk]),
+            'update_time': datetime.datetime.now(),
+        }
+        failed = [(k, v['error_msg']) for k, v in chunk if v['status'] == SMSDeliveryStatus.failed and v['error_msg']]
+        if failed:
+            fields['error_msg'] = case(SMSRecord.outid, failed, SMSRecord.error_msg)
+        updated += SMSRecord.update(**fields).where(
+            (SMSRecord.provider_id == provider_id) & SMSRecord.outid.in_([k for k, _ in chunk])
+        ).execute()
+    return updated
+
+
+class DeliveryReportIngester(object):
+    """
+    接收拉取或推送的状态报告，按 provider 和 outid 去重后定期批量写入
+
+    写入失败的报告会放回，待写入的报告数超过 max_pending 时丢弃新报告。
+    """
+
+    def __init__(self, flush_interval=5, max_pending=100000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # provider_id -> {outid: report}
+
+    def pending_count(self):
+        return sum(len(i) for i in self._pending.values())
+
+    def add(self, provider_id, status_list):
+        """status_list 的格式与 BaseClient.pull_status 相同"""
+        if self.pending_count() >= self.max_pending:
+            delivery_report_logger.error('delivery_report_dropped,%s %s' % (provider_id, len(status_list)))
+            metrics.incr('delivery_report.dropped', len(status_list), provider=provider_id)
+            return
+        reports = self._pending.setdefault(provider_id, {})
+        for i in status_list:
+            reports[i['sid']] = {
+                'status': _REPORT_STATUS.get(i['status'], SMSDeliveryStatus.unknown),
+                'receive_time': _parse_receive_time(i['receive_time']),
+                'error_msg': (i.get('error_msg') or '')[:128],
+            }
+        metrics.incr('delivery_report.received', len(status_list), provider=provider_id)
+
+    def run(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            if not self._pending:
+                continue
+            try:
+                with db.execution_context(with_transaction=False):
+                    self.flush()
+            except Exception:
+                delivery_report_logger.exception('delivery_report_flush_failed')
+
+    def flush(self):
+        pending, self._pending = self._pending, {}
+        while pending:
+            provider_id, reports = pending.popitem()
+            start = time.time()
+            try:
+                updated = apply_delivery_reports(provider_id, reports)
+            except Exception:
+                # 放回，新收到的同一 outid 报告优先
+                pending[provider_id] = reports
+                for pid, old_reports in pending.items():
+                    old_reports.update(self._pending.get(pid, {}))
+                    self._pending[pid] = old_reports
+                raise
+            self._report_metrics(provider_id, reports, updated, time.time() - start)
+
+    def _report_metrics(self, provider_id, reports, updated, duration):
+        if not metrics.enabled:
+            return
+        now = datetime.datetime.now()
+        lags = [(now - i['receive_time']).total_seconds() for i in reports.values() if i['receive_time']]
+        metrics.incr('delivery_report.applied', updated, provider=provider_id)
+        # 没有匹配到记录的报告, outid 错误或记录还未写入
+        metrics.incr('delivery_report.unmatched', len(reports) - updated, provider=provider_id)
+        metrics.timing('delivery_report.flush', duration * 1000, provider=provider_id)
+        if lags:
+            # 手机接收到写入数据库的延迟
+            metrics.timing('delivery_report.lag', sum(lags) / len(lags) * 1000, provider=provider_id)
+            metrics.gauge('delivery_report.max_lag', max(lags), provider=provider_id)
+
+
+def pull_delivery_reports(provider, ingester, interval=None, size=100):
+    """持续拉取 provider 的状态报告，拉空后等待 interval 秒"""
+    interval = interval or Config.DELIVERY_REPORT_PULL_INTERVAL
+    api_client = provider.api_client
+    while True:
+        try:
+            has_more, status_list = api_client.pull_status(size)
+        except Exception as e:
+            delivery_report_logger.error('pull_delivery_reports_failed,%s %s' % (provider.id, e))
+            has_more = False
+        else:
+            if status_list:
+                ingester.add(provider.id, status_list)
+        if not has_more:
+            gevent.sleep(interval)
+
+
+def spawn_delivery_report_pullers(ingester):
+    """为每个支持拉取的 provider 启动一个 greenlet"""
+    providers = [i for i in SMSProvider.select() if i.api_client.PULL_STATUS_SUPPORTED]
+    return [gevent.spawn(pull_delivery_reports, provider, ingester) for provider in providers]
+
+
+delivery_reports = DeliveryReportIngester(flush_interval=Config.DELIVERY_REPORT_FLUSH_INTERVAL)
+gevent.spawn(delivery_reports.run)
+
+
+@atexit.register
+def _flush_delivery_reports():
+    if delivery_reports.pending_count():
+        with db.execution_context(with_transaction=False):
+            delivery_reports.flush()
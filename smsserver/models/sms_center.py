@@ -1,19 +1,56 @@
 # coding: utf-8
+import atexit
 import datetime
 import logging
+import time
+import uuid
+from collections import defaultdict
 
+import gevent
+import redis
 import simplejson
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
 from peewee import CharField, DateTimeField, IntegerField, TextField
+from playhouse.shortcuts import case
 from smsserver.bgtask import spawn_bgtask
-from smsserver.models import BaseModel
-from smsserver.models.const import SMSProviderIdent, SMSSendStatus
+from smsserver.models import BaseModel, db
+from smsserver.models.const import SMSDeliveryStatus, SMSProviderIdent, SMSSendStatus
+from smsserver.models.sms_stats import send_stats
+from smsserver.models.write_behind import WriteBehindWriter
+from smsserver.utils import metrics
+from smsserver.utils.circuit_breaker import CircuitBreakerRegistry
+from smsserver.utils.latency import LatencyTracker
+from smsserver.utils.recent_providers import MemoryRecentProviderStore, RedisRecentProviderStore
 from smsserver.utils.provider import (
-    SMSSendFailed, alidayu_client, dahansantong_client, yunpianv1_client
+    SMSSendFailed, SMSSendTimeout, alidayu_client, dahansantong_client, sms_templates, yunpianv1_client
 )
-from smsserver.utils.weighted_shuffle import weighted_shuffle
+from smsserver.utils.weighted_shuffle import WeightedSampler, weighted_shuffle
+from conf import Config
 
 send_sms_logger = logging.getLogger('send_sms')
 
+# 按 (provider_id, service_key) 统计的熔断器，每个进程独立
+circuit_breakers = CircuitBreakerRegistry(
+    window=Config.CIRCUIT_BREAKER_WINDOW,
+    min_requests=Config.CIRCUIT_BREAKER_MIN_REQUESTS,
+    error_rate=Config.CIRCUIT_BREAKER_ERROR_RATE,
+    open_seconds=Config.CIRCUIT_BREAKER_OPEN_SECONDS
+)
+
+
+def _create_recent_provider_store():
+    if Config.RECENT_PROVIDER_STORE == 'redis':
+        return RedisRecentProviderStore(redis.StrictRedis.from_url(Config.REDIS_URL),
+                                        window=Config.RECENT_PROVIDER_WINDOW)
+    return MemoryRecentProviderStore(window=Config.RECENT_PROVIDER_WINDOW)
+
+
+# 每个号码最近成功发送过的 provider，用于降低重复使用同一服务的权重
+recent_providers = _create_recent_provider_store()
+# 按 (provider_id, service_key) 记录最近的成功发送耗时，用于计算对冲发送的等待时间
+provider_latency = LatencyTracker()
+
 
 class OutOfServiceArea(Exception):
     pass
@@ -23,39 +60,50 @@ def _get_service_key(is_sms):
     return 'sms' if is_sms else 'voice'
 
 
-def _get_used_provider_ids(country_code, phone_number, minutes=30):
-    now = datetime.datetime.now()
-    past = now - datetime.timedelta(minutes=minutes)
-    used_providers = SMSRecord\
-        .select(SMSRecord.provider_id)\
-        .distinct()\
-        .where(
-            SMSRecord.create_time.between(past, now) &
-            (SMSRecord.phone_number == phone_number) &
-            (SMSRecord.country_code == country_code)
-        )
-    return [x.provider_id for x in used_providers]
+def _get_used_provider_ids(country_code, phone_number):
+    try:
+        return recent_providers.get(country_code, phone_number)
+    except redis.RedisError as e:
+        # 只影响权重，不影响发送
+        send_sms_logger.error('get_used_provider_ids_failed,%s %s' % (phone_number, e))
+        return []
+
+
+def _mark_provider_used(country_code, phone_number, provider_id):
+    try:
+        recent_providers.add(country_code, phone_number, provider_id)
+    except redis.RedisError as e:
+        send_sms_logger.error('mark_provider_used_failed,%s %s' % (phone_number, e))
 
 
 def _get_providers(country_code, phone_number, service_key):
+    """
+    从路由表快照中获取可用的 (provider, weight)，不访问数据库
+
+    熔断中的 provider 会被剔除，全部熔断时仍返回所有 provider
+    """
     try:
-        provider_ids = SMSProviderServiceArea.get_avaliable_sms_providers(country_code, service_key)
+        choices = routing_table.get_choices(country_code, service_key)
     except OutOfServiceArea:
         raise SMSSendFailed(u'短信无法发送至该地区')
-    providers = SMSProvider.select().where(
-        SMSProvider.id.in_(provider_ids) &
-        SMSProvider.weight > 0
-    )
-    return providers
+    available_choices = tuple(i for i in choices if circuit_breakers.get((i[0].id, service_key)).is_available())
+    if not available_choices or len(available_choices) == len(choices):
+        # 返回快照中的 tuple，调用方可以据此复用快照缓存的 WeightedSampler
+        return choices
+    return available_choices
 
 
 def _get_weighted_providers(country_code, phone_number, service_key):
     """按权重并结合随机数打乱providers顺序"""
     providers = _get_providers(country_code, phone_number, service_key)
     used_provider_ids = _get_used_provider_ids(country_code, phone_number)
+    if not any(provider.id in used_provider_ids for provider, _ in providers):
+        # 权重没有调整时使用快照缓存的 sampler
+        sampler = routing_table.get_sampler(country_code, service_key)
+        if sampler.choices is providers:
+            return sampler.shuffle()
     choices = []
-    for provider in providers:
-        weight = provider.weight
+    for provider, weight in providers:
         # 降低已用过服务的权重
         if provider.id in used_provider_ids:
             weight = weight / 1000.0
@@ -63,38 +111,176 @@ def _get_weighted_providers(country_code, phone_number, service_key):
     return weighted_shuffle(choices)
 
 
-def _send(country_code, phone_number, text, service_key):
-    for provider in _get_weighted_providers(country_code, phone_number, service_key):
+def _send(country_code, phone_number, text, service_key, write_behind=False, template_id=None, params=None):
+    with metrics.timer('sms_center.route', service_key=service_key):
+        providers = _get_weighted_providers(country_code, phone_number, service_key)
+    for provider in providers:
         try:
-            return provider.send(country_code, phone_number, text, service_key)
+            return provider.send(country_code, phone_number, text, service_key, write_behind=write_behind,
+                                 template_id=template_id, params=params)
         except SMSSendFailed as e:
             send_sms_logger.error('sms_send_failed,%s %s' % (phone_number, e.message))
+            metrics.incr('sms_center.fallback', provider=provider.id, service_key=service_key)
             continue
     raise SMSSendFailed
 
 
-def _send_no_raise(country_code, phone_number, text, service_key):
+def _get_hedge_delay(provider, service_key):
+    """等待 provider 返回多久后发起对冲请求，取最近耗时的分位数"""
+    delay = provider_latency.percentile((provider.id, service_key), Config.HEDGE_DELAY_PERCENTILE)
+    if delay is None:
+        return Config.HEDGE_DEFAULT_DELAY
+    return max(delay, Config.HEDGE_MIN_DELAY)
+
+
+def _send_hedged(country_code, phone_number, text, service_key, template_id=None, params=None):
+    """
+    对冲发送
+
+    当前 provider 超过 _get_hedge_delay 仍未返回时，并发请求下一个 provider，
+    最先成功的结果返回，额外的并发请求数不超过 HEDGE_MAX_EXTRA_SENDS。
+    所有请求都会写入 SMSRecord，先返回后其余请求仍会执行完毕。
+    """
+    with metrics.timer('sms_center.route', service_key=service_key):
+        providers = _get_weighted_providers(country_code, phone_number, service_key)
+    result = AsyncResult()
+
+    def _attempt(provider):
+        try:
+            record = provider.send(country_code, phone_number, text, service_key,
+                                   template_id=template_id, params=params)
+        except SMSSendFailed as e:
+            send_sms_logger.error('sms_send_failed,%s %s' % (phone_number, e.message))
+        else:
+            if not result.ready():
+                result.set(record)
+
+    def _spawn(provider):
+        # 每个 greenlet 使用单独的数据库连接
+        return gevent.spawn(db.execution_context(with_transaction=False)(_attempt), provider)
+
+    running, extra_sends, index, delay = [], 0, 0, None
+    while not result.ready():
+        running = [i for i in running if not i.ready()]
+        if not running:
+            if index >= len(providers):
+                raise SMSSendFailed
+            # 没有进行中的请求，正常 failover
+            running.append(_spawn(providers[index]))
+            delay = _get_hedge_delay(providers[index], service_key)
+            index += 1
+        elif extra_sends < Config.HEDGE_MAX_EXTRA_SENDS and index < len(providers):
+            send_sms_logger.info('sms_send_hedged,%s %s' % (phone_number, providers[index].id))
+            running.append(_spawn(providers[index]))
+            delay = _get_hedge_delay(providers[index], service_key)
+            extra_sends, index = extra_sends + 1, index + 1
+        else:
+            delay = None
+        gevent.wait(running + [result], timeout=delay, count=1)
+    return result.get()
+
+
+def _send_no_raise(country_code, phone_number, text, service_key, template_id=None, params=None):
     try:
-        _send(country_code, phone_number, text, service_key)
+        _send(country_code, phone_number, text, service_key, write_behind=Config.RECORD_WRITE_BEHIND,
+              template_id=template_id, params=params)
     except SMSSendFailed as e:
         send_sms_logger.error('sms_send_failed,%s %s' % (phone_number, e.message))
 
 
+def _batch_send(job_id, country_code, phone_numbers, text, provider_id):
+    """按批发送同一内容，失败的号码退回到逐条发送的流程"""
+    provider = SMSProvider.get(id=provider_id)
+    try:
+        failed_phone_numbers = provider.batch_send(job_id, country_code, phone_numbers, text)
+    except SMSSendFailed as e:
+        send_sms_logger.error('sms_batch_send_failed,%s %s %s' % (job_id, provider_id, e.message))
+        failed_phone_numbers = phone_numbers
+
+    for phone_number in failed_phone_numbers:
+        spawn_bgtask(_send_no_raise, country_code=country_code, phone_number=phone_number,
+                     text=text, service_key='sms')
+
+
+def _truncate_error_msg(e):
+    # record.error_msg 最长 128，切掉尾巴
+    if isinstance(e.message, str):
+        error_msg = e.message.decode('utf-8')
+    else:
+        error_msg = e.message
+    if len(error_msg) > 128:
+        error_msg = u"{}...".format(error_msg[:125])
+    return error_msg
+
+
 class SMSCenter(object):
 
     @classmethod
-    def send(cls, country_code, phone_number, text, is_async=True, is_sms=True):
+    def send(cls, country_code, phone_number, text, is_async=True, is_sms=True, is_hedged=False,
+             template_id=None, params=None, lane=None):
+        """
+        is_hedged 只在同步发送时生效
+        lane 为异步发送使用的后台任务通道，默认 Config.BGTASK_DEFAULT_LANE
+        指定 template_id 时 text 为渲染后的文本，服务商配置了模板的使用模板接口发送
+        """
         service_key = _get_service_key(is_sms)
-        params = dict(
+        kw = dict(
             country_code=country_code,
             phone_number=phone_number,
             text=text,
             service_key=service_key
         )
+        if template_id is not None:
+            kw.update(template_id=template_id, params=params)
         if is_async:
-            spawn_bgtask(_send_no_raise, **params)
+            # 异步发送只统计入队耗时，执行耗时见 bgtask.execute
+            with metrics.timer('sms_center.enqueue', service_key=service_key):
+                spawn_bgtask(_send_no_raise, lane=lane, **kw)
+        elif is_hedged:
+            with metrics.timer('sms_center.send', service_key=service_key, mode='hedged'):
+                _send_hedged(**kw)
         else:
-            _send(**params)
+            with metrics.timer('sms_center.send', service_key=service_key, mode='sync'):
+                _send(**kw)
+
+    @classmethod
+    def send_template(cls, country_code, phone_number, template_id, params, **kw):
+        """按模板发送，template_id 见 Config.SMS_TEMPLATES"""
+        text = sms_templates.get(template_id).render(params)
+        cls.send(country_code, phone_number, text, template_id=template_id, params=params, **kw)
+
+    @classmethod
+    def batch_send(cls, country_code, recipients):
+        """
+        批量发送短信
+
+        Args:
+            recipients: (phone_number, text) 组成的列表
+        Returns:
+            job_id, 对应 SMSRecord.job_id
+
+        每个号码按权重选定 provider 后，按 (provider, text) 分组，
+        通过服务商的批量接口分批异步发送。
+        """
+        choices = _get_providers(country_code, None, 'sms')
+        if not choices:
+            raise SMSSendFailed(u'没有可用的短信服务')
+
+        sampler = routing_table.get_sampler(country_code, 'sms')
+        if sampler.choices is not choices:
+            # 部分 provider 熔断
+            sampler = WeightedSampler(choices)
+        groups = defaultdict(list)
+        for phone_number, text in recipients:
+            groups[(sampler.choice(), text)].append(phone_number)
+
+        job_id = uuid.uuid4().hex
+        for (provider, text), phone_numbers in groups.iteritems():
+            size = provider.api_client.BATCH_MAX_SIZE
+            for i in range(0, len(phone_numbers), size):
+                spawn_bgtask(_batch_send, job_id=job_id, country_code=country_code,
+                             phone_numbers=phone_numbers[i:i+size], text=text, provider_id=provider.id)
+        return job_id
 
 
 class SMSProvider(BaseModel):
@@ -121,46 +307,132 @@ class SMSProvider(BaseModel):
         self.weight = weight
         self.save()
 
-    def send(self, country_code, phone_number, text, service_key):
+    def send(self, country_code, phone_number, text, service_key, job_id='', write_behind=False,
+             template_id=None, params=None):
+        """
+        write_behind 为 True 时，发送完成后才生成 SMSRecord，由 record_writer 批量写入，
+        调用方拿不到 record.id
+
+        template_id 不为空时通过 client 的模板接口发送，text 只用于记录
+        """
         api_client = self.api_client
-        record = SMSRecord.create(country_code=country_code, phone_number=phone_number,
-                                  text=text, provider_id=self.id)
+        tags = dict(provider=self.id, service_key=service_key)
+        breaker = circuit_breakers.get((self.id, service_key))
+        # half_open 时占用探测名额。全部熔断时仍会尝试发送，所以这里不拒绝
+        breaker.allow_request()
+        fields = dict(country_code=country_code, phone_number=phone_number,
+                      text=text, provider_id=self.id, job_id=job_id)
+        if write_behind:
+            record = SMSRecord(**fields)
+            save = record_writer.add
+        else:
+            with metrics.timer('provider.record_create', **tags):
+                record = SMSRecord.create(**fields)
+            save = SMSRecord.save
+        start_time = time.time()
         try:
-            if service_key == 'sms':
-                ret = api_client.send_sms(country_code, phone_number, text)
-            else:
-                ret = api_client.send_voice(country_code, phone_number, text)
+            with metrics.timer('provider.api_call', **tags):
+                if template_id is not None:
+                    template = sms_templates.get(template_id)
+                    if service_key == 'sms':
+                        ret = api_client.send_template_sms(country_code, phone_number, template, params)
+                    else:
+                        ret = api_client.send_template_voice(country_code, phone_number, template, params)
+                elif service_key == 'sms':
+                    ret = api_client.send_sms(country_code, phone_number, text)
+                else:
+                    ret = api_client.send_voice(country_code, phone_number, text)
         except SMSSendFailed as e:
-            # record.error_msg 最长 128，切掉尾巴
-            if isinstance(e.message, str):
-                error_msg = e.message.decode('utf-8')
-            else:
-                error_msg = e.message
-            if len(error_msg) > 128:
-                error_msg = u"{}...".format(error_msg[:125])
-            record.status, record.error_msg = SMSSendStatus.failed, error_msg
-            record.save()
+            breaker.record_failure(is_timeout=isinstance(e, SMSSendTimeout))
+            record.status, record.error_msg = SMSSendStatus.failed, _truncate_error_msg(e)
+            with metrics.timer('provider.record_save', **tags):
+                save(record)
+            send_stats.add(self.id, record.status, phone_number, record.create_time)
             raise e
         else:
+            breaker.record_success()
+            provider_latency.record((self.id, service_key), time.time() - start_time)
+            _mark_provider_used(country_code, phone_number, self.id)
             record.status, record.outid = SMSSendStatus.success, ret['outid']
-            record.save()
+            with metrics.timer('provider.record_save', **tags):
+                save(record)
+            send_stats.add(self.id, record.status, phone_number, record.create_time)
         return record
 
+    def batch_send(self, job_id, country_code, phone_numbers, text):
+        """
+        通过服务商的批量接口发送，SMSRecord 批量写入和更新
+
+        Returns:
+            发送失败的号码列表
+        """
+        api_client = self.api_client
+        if api_client.BATCH_MAX_SIZE <= 1:
+            failed_phone_numbers = []
+            for phone_number in phone_numbers:
+                try:
+                    self.send(country_code, phone_number, text, 'sms', job_id=job_id)
+                except SMSSendFailed:
+                    failed_phone_numbers.append(phone_number)
+            return failed_phone_numbers
+
+        now = datetime.datetime.now()
+        SMSRecord.insert_many([
+            dict(country_code=country_code, phone_number=phone_number, text=text,
+                 provider_id=self.id, job_id=job_id, create_time=now, update_time=now)
+            for phone_number in phone_numbers
+        ]).execute()
+
+        def _update_records(phone_numbers, **fields):
+            fields['update_time'] = datetime.datetime.now()
+            SMSRecord.update(**fields).where(
+                (SMSRecord.job_id == job_id) &
+                (SMSRecord.provider_id == self.id) &
+                SMSRecord.phone_number.in_(phone_numbers)
+            ).execute()
+            for phone_number in phone_numbers:
+                send_stats.add(self.id, fields['status'], phone_number, now)
+
+        breaker = circuit_breakers.get((self.id, 'sms'))
+        breaker.allow_request()
+        try:
+            outids = api_client.batch_send_sms(country_code, phone_numbers, text)
+        except SMSSendFailed as e:
+            breaker.record_failure(is_timeout=isinstance(e, SMSSendTimeout))
+            _update_records(phone_numbers, status=SMSSendStatus.failed, error_msg=_truncate_error_msg(e))
+            raise e
+        breaker.record_success()
+
+        if outids:
+            _update_records(outids.keys(), status=SMSSendStatus.success,
+                            outid=case(SMSRecord.phone_number, outids.items()))
+        failed_phone_numbers = [i for i in phone_numbers if i not in outids]
+        if failed_phone_numbers:
+            _update_records(failed_phone_numbers, status=SMSSendStatus.failed,
+                            error_msg=u'批量发送失败')
+        return failed_phone_numbers
+
 
 class SMSRecord(BaseModel):
     text = CharField()
     phone_number = CharField(index=True)
     country_code = CharField()
-    outid = CharField()
+    outid = CharField(index=True)
     create_time = DateTimeField(default=datetime.datetime.now, index=True)
     update_time = DateTimeField(default=datetime.datetime.now)
     receive_time = DateTimeField()
     error_msg = CharField()
     provider_id = IntegerField()
     status = IntegerField(default=SMSSendStatus.initial)
+    delivery_status = IntegerField(default=SMSDeliveryStatus.unknown)  # 状态报告
+    job_id = CharField(default='', index=True)  # 批量发送任务 id
 
     class Meta:
         db_table = 'sms_record'
+        indexes = (
+            # /god/query 按号码分页查询
+            (('phone_number', 'create_time', 'id'), False),
+        )
 
 
 class SMSProviderServiceArea(BaseModel):
@@ -173,12 +445,13 @@ class SMSProviderServiceArea(BaseModel):
     @classmethod
     def set_avaliable_sms_providers(cls, country_code, providers, is_sms=True):
         obj = cls.select().where(cls.country_code == country_code.strip()).first()
-        if obj:
+        if not obj:
             obj = cls.create(country_code=country_code.strip())
         providers_dict = simplejson.loads(obj.providers_json)
         providers_dict[_get_service_key(is_sms)] = {'provider_ids': [i.id for i in providers]}
-        obj.provider_json = simplejson.dumps(providers_dict)
+        obj.providers_json = simplejson.dumps(providers_dict)
         obj.save()
+        routing_table.invalidate()
 
     @classmethod
     def get_avaliable_sms_providers(cls, country_code, service_key):
@@ -188,3 +461,102 @@ class SMSProviderServiceArea(BaseModel):
 
         providers_dict = simplejson.loads(obj.providers_json).get(service_key, {})
         return providers_dict.get('provider_ids', [])
+
+
+class RoutingSnapshot(object):
+    """
+    路由表快照，生成后只读
+
+    areas: {country_code: {service_key: ((provider, weight), ...)}}
+    """
+
+    def __init__(self, areas, expire_at):
+        self._areas = areas
+        self.expire_at = expire_at
+        self._samplers = {}
+
+    def is_expired(self):
+        return time.time() >= self.expire_at
+
+    def get_choices(self, country_code, service_key):
+        services = self._areas.get(country_code.strip())
+        if services is None:
+            raise OutOfServiceArea
+        return services.get(service_key, ())
+
+    def get_sampler(self, country_code, service_key):
+        """快照只读，WeightedSampler 按 (country_code, service_key) 缓存"""
+        key = (country_code.strip(), service_key)
+        sampler = self._samplers.get(key)
+        if sampler is None:
+            sampler = self._samplers[key] = WeightedSampler(self.get_choices(country_code, service_key))
+        return sampler
+
+
+class RoutingTable(object):
+    """
+    进程内的路由表缓存，按 (country_code, service_key) 保存解码后的 provider 和权重
+
+    过期或被 invalidate 后由第一个请求重新加载，新快照整体替换旧快照，
+    读取方拿到的始终是一个完整的快照。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = Semaphore()
+
+    def _load(self):
+        providers = {}
+        for provider in SMSProvider.select():
+            if provider.weight > 0:
+                providers[provider.id] = provider
+
+        areas = {}
+        for area in SMSProviderServiceArea.select().order_by(SMSProviderServiceArea.id):
+            country_code = area.country_code.strip()
+            # 与 get_avaliable_sms_providers 保持一致，同一地区只取第一条
+            if country_code in areas:
+                continue
+            services = {}
+            for service_key, d in simplejson.loads(area.providers_json).iteritems():
+                services[service_key] = tuple((providers[pid], providers[pid].weight)
+                                              for pid in d.get('provider_ids', []) if pid in providers)
+            areas[country_code] = services
+        return RoutingSnapshot(areas, time.time() + self.ttl)
+
+    def get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and not snapshot.is_expired():
+            return snapshot
+
+        with self._lock:
+            # 等锁期间可能已被其他 greenlet 加载
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.is_expired():
+                snapshot = self._load()
+                self._snapshot = snapshot
+        return snapshot
+
+    def get_choices(self, country_code, service_key):
+        return self.get_snapshot().get_choices(country_code, service_key)
+
+    def get_sampler(self, country_code, service_key):
+        return self.get_snapshot().get_sampler(country_code, service_key)
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+routing_table = RoutingTable(Config.ROUTING_CACHE_TTL)
+
+record_writer = WriteBehindWriter(SMSRecord, batch_size=Config.RECORD_WRITER_BATCH_SIZE,
+                                  flush_interval=Config.RECORD_WRITER_FLUSH_INTERVAL)
+gevent.spawn(record_writer.run)
+
+
+@atexit.register
+def _flush_record_writer():
+    if record_writer.pending_count():
+        with db.execution_context(with_transaction=False):
+            record_writer.flush()
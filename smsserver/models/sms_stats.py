@@ -0,0 +1,152 @@
+# coding: utf-8
+import atexit
+import logging
+from collections import Counter
+
+import gevent
+from peewee import CharField, DateField, DateTimeField, IntegerField, fn
+from smsserver.models import BaseModel, db
+from smsserver.models.const import SMSSendStatus
+
+sms_stats_logger = logging.getLogger('sms_stats')
+
+
+class SMSSendHourlyStat(BaseModel):
+    """每个 provider 每小时各状态的发送数"""
+    provider_id = IntegerField()
+    status = IntegerField()
+    hour = DateTimeField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'sms_send_hourly_stat'
+        indexes = ((('hour', 'provider_id', 'status'), True),)
+
+
+class SMSPhoneDailyStat(BaseModel):
+    """每个号码每天发送成功数"""
+    phone_number = CharField()
+    day = DateField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'sms_phone_daily_stat'
+        indexes = ((('day', 'phone_number'), True),)
+
+
+def _increment(model, key_fields, counter, chunk_size=500):
+    """INSERT ... ON DUPLICATE KEY UPDATE 累加计数"""
+    items = counter.items()
+    columns = ', '.join('`%s`' % i for i in key_fields + ('count',))
+    placeholder = '(%s)' % ', '.join([db.interpolation] * (len(key_fields) + 1))
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i+chunk_size]
+        sql = 'INSERT INTO `%s` (%s) VALUES %s ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)' % (
+            model._meta.db_table, columns, ', '.join([placeholder] * len(chunk)))
+        params = []
+        for key, count in chunk:
+            params.extend(key)
+            params.append(count)
+        db.execute_sql(sql, params)
+
+
+class SendStatsAggregator(object):
+    """在进程内累加发送计数，定期写入 SMSSendHourlyStat 和 SMSPhoneDailyStat"""
+
+    def __init__(self, flush_interval=10):
+        self.flush_interval = flush_interval
+        self._hourly = Counter()  # (provider_id, status, hour) -> count
+        self._daily = Counter()  # (phone_number, day) -> count
+
+    def add(self, provider_id, status, phone_number, create_time, count=1):
+        hour = create_time.replace(minute=0, second=0, microsecond=0)
+        self._hourly[(provider_id, status, hour)] += count
+        if status == SMSSendStatus.success:
+            self._daily[(phone_number, create_time.date())] += count
+
+    def pending_count(self):
+        return len(self._hourly) + len(self._daily)
+
+    def run(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            if not self.pending_count():
+                continue
+            try:
+                with db.execution_context(with_transaction=False):
+                    self.flush()
+            except Exception:
+                sms_stats_logger.exception('sms_stats_flush_failed')
+
+    def flush(self):
+        hourly, self._hourly = self._hourly, Counter()
+        daily, self._daily = self._daily, Counter()
+        try:
+            if hourly:
+                _increment(SMSSendHourlyStat, ('provider_id', 'status', 'hour'), hourly)
+                hourly = Counter()
+            if daily:
+                _increment(SMSPhoneDailyStat, ('phone_number', 'day'), daily)
+        except Exception:
+            # 写入失败时放回，下次重试
+            self._hourly.update(hourly)
+            self._daily.update(daily)
+            raise
+
+
+def get_send_counts_by_provider(start_time):
+    """返回 {provider_id: {status: count}}，按小时统计"""
+    hour = start_time.replace(minute=0, second=0, microsecond=0)
+    rows = SMSSendHourlyStat\
+        .select(SMSSendHourlyStat.provider_id, SMSSendHourlyStat.status,
+                fn.SUM(SMSSendHourlyStat.count).alias('total'))\
+        .where(SMSSendHourlyStat.hour >= hour)\
+        .group_by(SMSSendHourlyStat.provider_id, SMSSendHourlyStat.status)\
+        .tuples()
+    counts = {}
+    for provider_id, status, total in rows:
+        counts.setdefault(provider_id, {})[status] = int(total)
+    return counts
+
+
+def get_send_counts_by_phone_number(start_time, min_count=2):
+    """返回 [(phone_number, count)]，按天统计，按 count 倒序"""
+    total = fn.SUM(SMSPhoneDailyStat.count)
+    rows = SMSPhoneDailyStat\
+        .select(SMSPhoneDailyStat.phone_number, total.alias('total'))\
+        .where(SMSPhoneDailyStat.day >= start_time.date())\
+        .group_by(SMSPhoneDailyStat.phone_number)\
+        .having(total >= min_count)\
+        .order_by(total.desc())\
+        .tuples()
+    return [(phone_number, int(count)) for phone_number, count in rows]
+
+
+def backfill(start_time, end_time):
+    """
+    用 sms_record 中 [start_time, end_time) 的数据重新计算统计，已有的计数会被覆盖。
+    start_time 和 end_time 需要按天对齐，并且不能包含在线累加过计数的时间段
+    """
+    db.execute_sql(
+        "INSERT INTO `sms_send_hourly_stat` (`provider_id`, `status`, `hour`, `count`) "
+        "SELECT `provider_id`, `status`, DATE_FORMAT(`create_time`, '%%Y-%%m-%%d %%H:00:00'), COUNT(*) "
+        "FROM `sms_record` WHERE `create_time` >= %s AND `create_time` < %s AND `status` != %s "
+        "GROUP BY 1, 2, 3 ON DUPLICATE KEY UPDATE `count` = VALUES(`count`)",
+        (start_time, end_time, SMSSendStatus.initial))
+    db.execute_sql(
+        "INSERT INTO `sms_phone_daily_stat` (`phone_number`, `day`, `count`) "
+        "SELECT `phone_number`, DATE(`create_time`), COUNT(*) "
+        "FROM `sms_record` WHERE `create_time` >= %s AND `create_time` < %s AND `status` = %s "
+        "GROUP BY 1, 2 ON DUPLICATE KEY UPDATE `count` = VALUES(`count`)",
+        (start_time, end_time, SMSSendStatus.success))
+
+
+send_stats = SendStatsAggregator()
+gevent.spawn(send_stats.run)
+
+
+@atexit.register
+def _flush_send_stats():
+    if send_stats.pending_count():
+        with db.execution_context(with_transaction=False):
+            send_stats.flush()
@@ -1,15 +1,19 @@
 # coding: utf-8
 import datetime
-import random
-import string
 from smsserver.models import BaseModel
 from smsserver.models.const import SMSVerificationStatus
 from smsserver.models.sms_center import SMSCenter
-from peewee import CharField, DateTimeField, IntegerField
+from smsserver.utils.code_generator import CodeGenerator
+from smsserver.utils.provider import sms_templates
+from peewee import CharField, DateTimeField, IntegerField, IntegrityError
 from conf import Config
 
 VERIFICATION_CODE_EXPIRE_MINUTES = Config.VERIFICATION_CODE_EXPIRE_MINUTES
 VERIFY_TIMES_LIMIT = Config.VERIFY_TIMES_LIMIT
+# serial_number 冲突时重新生成的次数
+CREATE_RETRY_TIMES = 3
+
+code_generator = CodeGenerator(pool_size=Config.VERIFICATION_CODE_POOL_SIZE)
 
 
 class SMSVerification(BaseModel):
@@ -19,7 +23,7 @@ class SMSVerification(BaseModel):
     create_time = DateTimeField(default=datetime.datetime.now)
     update_time = DateTimeField(default=datetime.datetime.now)
     expire_time = DateTimeField(default=lambda: datetime.datetime.now() + datetime.timedelta(minutes=VERIFICATION_CODE_EXPIRE_MINUTES))
-    serial_number = CharField(index=True)
+    serial_number = CharField(unique=True)
     status = IntegerField(default=SMSVerificationStatus.unused)
     verify_times = IntegerField(default=0)
 
@@ -27,20 +31,22 @@ class SMSVerification(BaseModel):
         db_table = 'sms_verification'
         indexes = ((('country_code', 'phone_number', 'status', 'expire_time'), False),)
 
+    @staticmethod
+    def _random_serial_number_and_code():
+        return code_generator.get()
+
     @classmethod
-    def _generate_serial_number_and_code(cls):
-        serial_number = ''.join([random.choice(string.ascii_letters+string.digits) for i in range(16)])
-        code = ''.join([random.choice(string.digits) for i in range(6)])
-        if cls.select().where((cls.serial_number == serial_number) & (cls.code == code)).count():
-            return cls._generate_serial_number_and_code()
-        return serial_number, code
+    def _unexpired_condition(cls, country_code, phone_number, now):
+        '''未使用、未过期且验证次数未达到上限'''
+        return ((cls.country_code == country_code) & (cls.phone_number == phone_number) &
+                (cls.status == SMSVerificationStatus.unused) & (cls.expire_time > now) &
+                (cls.verify_times < VERIFY_TIMES_LIMIT))
 
     @classmethod
     def _get_unexpired_verification_code(cls, country_code, phone_number):
         '''获得当前未过期的验证码'''
         now = datetime.datetime.now()
-        obj = cls.select().where((cls.country_code == country_code) & (cls.phone_number == phone_number) &
-                                 (cls.status == SMSVerificationStatus.unused) & (cls.expire_time > now)).order_by(cls.id).first()
+        obj = cls.select().where(cls._unexpired_condition(country_code, phone_number, now)).order_by(cls.id).first()
         return obj
 
     @classmethod
@@ -55,41 +61,51 @@ class SMSVerification(BaseModel):
             unexpired_verification_code.save()
             return unexpired_verification_code
 
-        serial_number, code = cls._generate_serial_number_and_code()
-        obj = cls.create(country_code=country_code, phone_number=phone_number,
-                  serial_number=serial_number, code=code)
-        return obj
+        # serial_number 有唯一索引，冲突时重新生成，不需要预先查询
+        for i in range(CREATE_RETRY_TIMES):
+            serial_number, code = cls._random_serial_number_and_code()
+            try:
+                return cls.create(country_code=country_code, phone_number=phone_number,
+                                  serial_number=serial_number, code=code)
+            except IntegrityError:
+                if i == CREATE_RETRY_TIMES - 1:
+                    raise
 
     @classmethod
     def verify(cls, country_code, phone_number, code):
-        obj = cls._get_unexpired_verification_code(country_code, phone_number)
-
-        if not obj:
-            return False
-
-        # 验证码不正确
-        if obj.code != code:
-            obj.verify_times += 1
-            obj.save()
-            return False
+        '''
+        每一步都是单条 UPDATE，由受影响行数决定结果，并发验证时次数不会丢失:
+        1. 验证码正确且验证次数未达到上限时标记为已使用
+        2. 否则累加验证次数，达到 VERIFY_TIMES_LIMIT 后该验证码失效
+        '''
+        now = datetime.datetime.now()
+        condition = cls._unexpired_condition(country_code, phone_number, now)
 
-        # 验证次数超过限制, 返回验证失败
-        if obj.verify_times >= VERIFY_TIMES_LIMIT:
-            obj.expire_time, obj.verify_times = datetime.datetime.now(), obj.verify_times + 1
-            obj.save()
-            return False
+        matched = cls.update(status=SMSVerificationStatus.used, verify_times=cls.verify_times + 1,
+                             update_time=now).where(condition & (cls.code == code)).execute()
+        if matched:
+            return True
 
-        obj.status, obj.verify_times = SMSVerificationStatus.used, obj.verify_times + 1
-        obj.save()
-        return True
+        cls.update(verify_times=cls.verify_times + 1, update_time=now).where(condition).execute()
+        return False
 
     @property
-    def text(self):
+    def template_id(self):
         # 大陆、港澳台发送简体中文，其他地区发送英文
         if self.country_code in ('86', '852', '853', '886'):
-            return u'验证码：%s，请在%s分钟内完成验证。' % (self.code, VERIFICATION_CODE_EXPIRE_MINUTES)
+            return 'verification_code'
         else:
-            return u'Your confirmation code is %s, please verify in %s minutes.' % (self.code, VERIFICATION_CODE_EXPIRE_MINUTES)
+            return 'verification_code_en'
+
+    @property
+    def template_params(self):
+        return {'code': self.code, 'minutes': VERIFICATION_CODE_EXPIRE_MINUTES}
+
+    @property
+    def text(self):
+        return sms_templates.get(self.template_id).render(self.template_params)
 
-    def send(self, is_async=True, is_sms=True):
-        SMSCenter.send(self.country_code, self.phone_number, self.text, is_async=is_async, is_sms=is_sms)
+    def send(self, is_async=True, is_sms=True, is_hedged=False):
+        SMSCenter.send_template(self.country_code, self.phone_number, self.template_id, self.template_params,
+                                is_async=is_async, is_sms=is_sms, is_hedged=is_hedged,
+                                lane=Config.BGTASK_VERIFICATION_LANE)
@@ -0,0 +1,192 @@
+# coding: utf-8
+import atexit
+import datetime
+import logging
+import time
+
+import gevent
+import redis
+from smsserver.bgtask import BGTaskQueueFull, spawn_bgtask
+from smsserver.models import db
+from smsserver.models.const import SMSVerificationStatus
+from smsserver.models.sms_verification import SMSVerification, VERIFICATION_CODE_EXPIRE_MINUTES, VERIFY_TIMES_LIMIT
+from smsserver.models.write_behind import WriteBehindWriter
+from conf import Config
+
+verification_logger = logging.getLogger('verification')
+
+
+class MemoryVerificationKV(object):
+    """进程内实现，只用于测试和单进程开发环境"""
+
+    def __init__(self):
+        self._data = {}  # key -> (fields, expire_at)
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None or item[1] <= time.time():
+            self._data.pop(key, None)
+            return None
+        return item[0]
+
+    def create_or_get(self, key, fields, ttl, limit):
+        """
+        存在且验证次数未达到 limit 时延长过期时间并返回，否则保存 fields
+        返回值: (fields, created)
+        """
+        stored = self._get(key)
+        if stored is not None and stored['verify_times'] < limit:
+            self._data[key] = (stored, time.time() + ttl)
+            return dict(stored), False
+        fields = dict(fields, verify_times=0)
+        self._data[key] = (fields, time.time() + ttl)
+        return dict(fields), True
+
+    def verify(self, key, code, limit):
+        """
+        返回值: (is_valid, serial_number, verify_times)，验证码不存在时 serial_number 为 None
+        """
+        stored = self._get(key)
+        if stored is None or stored['verify_times'] >= limit:
+            return False, None, None
+        stored['verify_times'] += 1
+        if stored['code'] == code:
+            del self._data[key]
+            return True, stored['serial_number'], stored['verify_times']
+        return False, stored['serial_number'], stored['verify_times']
+
+
+class RedisVerificationKV(object):
+    """每个号码一个 hash，key 的过期时间即验证码的过期时间"""
+
+    _CREATE_OR_GET_SCRIPT = '''
+    local times = redis.call('HGET', KEYS[1], 'verify_times')
+    if times and tonumber(times) < tonumber(ARGV[2]) then
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+        return {0, redis.call('HGETALL', KEYS[1])}
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('HMSET', KEYS[1], 'verify_times', 0, unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return {1, redis.call('HGETALL', KEYS[1])}
+    '''
+
+    _VERIFY_SCRIPT = '''
+    local stored = redis.call('HMGET', KEYS[1], 'code', 'verify_times', 'serial_number')
+    if not stored[1] or tonumber(stored[2]) >= tonumber(ARGV[2]) then
+        return {0}
+    end
+    local times = redis.call('HINCRBY', KEYS[1], 'verify_times', 1)
+    if stored[1] == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        return {1, stored[3], times}
+    end
+    return {0, stored[3], times}
+    '''
+
+    INT_FIELDS = ('verify_times',)
+    FLOAT_FIELDS = ('create_time',)
+
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._create_or_get = redis_client.register_script(self._CREATE_OR_GET_SCRIPT)
+        self._verify = redis_client.register_script(self._VERIFY_SCRIPT)
+
+    def _parse(self, items):
+        fields = dict(zip(items[::2], items[1::2]))
+        for k in self.INT_FIELDS:
+            fields[k] = int(fields[k])
+        for k in self.FLOAT_FIELDS:
+            fields[k] = float(fields[k])
+        return fields
+
+    def create_or_get(self, key, fields, ttl, limit):
+        args = [ttl, limit]
+        for item in fields.items():
+            args.extend(item)
+        created, items = self._create_or_get(keys=[key], args=args)
+        return self._parse(items), bool(created)
+
+    def verify(self, key, code, limit):
+        ret = self._verify(keys=[key], args=[code, limit])
+        if len(ret) == 1:
+            return False, None, None
+        return bool(ret[0]), ret[1], ret[2]
+
+
+class HotVerificationStore(object):
+    """
+    验证码保存在带过期时间的 KV 中，接口与 SMSVerification 的
+    create_or_get_unused_verification_code / verify 相同。
+
+    新验证码通过 archive_writer 批量写入 MySQL，验证结果通过后台任务更新，
+    MySQL 中的数据只用于审计。
+    """
+
+    def __init__(self, kv, archive_writer=None, prefix='smsserver:verification'):
+        self.kv = kv
+        self.archive_writer = archive_writer
+        self.prefix = prefix
+        self.ttl = VERIFICATION_CODE_EXPIRE_MINUTES * 60
+
+    def _key(self, country_code, phone_number):
+        return '%s:%s:%s' % (self.prefix, country_code, phone_number)
+
+    def create_or_get_unused_verification_code(self, country_code, phone_number):
+        serial_number, code = SMSVerification._random_serial_number_and_code()
+        fields, created = self.kv.create_or_get(
+            self._key(country_code, phone_number),
+            {'serial_number': serial_number, 'code': code, 'create_time': time.time()},
+            self.ttl, VERIFY_TIMES_LIMIT
+        )
+        now = datetime.datetime.now()
+        obj = SMSVerification(country_code=country_code, phone_number=phone_number,
+                              serial_number=fields['serial_number'], code=fields['code'],
+                              verify_times=fields['verify_times'],
+                              create_time=datetime.datetime.fromtimestamp(fields['create_time']),
+                              update_time=now, expire_time=now + datetime.timedelta(seconds=self.ttl))
+        if created and self.archive_writer is not None:
+            self.archive_writer.add(obj)
+        return obj
+
+    def verify(self, country_code, phone_number, code):
+        is_valid, serial_number, verify_times = self.kv.verify(self._key(country_code, phone_number),
+                                                               code, VERIFY_TIMES_LIMIT)
+        if serial_number is not None and self.archive_writer is not None:
+            status = SMSVerificationStatus.used if is_valid else SMSVerificationStatus.unused
+            try:
+                spawn_bgtask(_archive_verify_result, serial_number, status, verify_times)
+            except BGTaskQueueFull:
+                verification_logger.error('archive_verify_result_failed,%s' % serial_number)
+        return is_valid
+
+
+def _archive_verify_result(serial_number, status, verify_times):
+    SMSVerification.update(status=status, verify_times=verify_times, update_time=datetime.datetime.now())\
+        .where(SMSVerification.serial_number == serial_number).execute()
+
+
+def _create_verification_store():
+    backend = Config.VERIFICATION_STORE
+    if backend == 'mysql':
+        return SMSVerification
+
+    if backend == 'redis':
+        kv = RedisVerificationKV(redis.StrictRedis.from_url(Config.REDIS_URL))
+    else:
+        kv = MemoryVerificationKV()
+    archive_writer = WriteBehindWriter(SMSVerification, batch_size=Config.RECORD_WRITER_BATCH_SIZE,
+                                       flush_interval=Config.RECORD_WRITER_FLUSH_INTERVAL)
+    gevent.spawn(archive_writer.run)
+
+    @atexit.register
+    def _flush_archive_writer():
+        if archive_writer.pending_count():
+            with db.execution_context(with_transaction=False):
+                archive_writer.flush()
+
+    return HotVerificationStore(kv, archive_writer)
+
+
+# mysql 时直接使用 SMSVerification
+verification_store = _create_verification_store()
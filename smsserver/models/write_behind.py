@@ -0,0 +1,98 @@
+# coding: utf-8
+import logging
+
+import gevent
+from gevent.event import Event
+from smsserver.models import db
+
+write_behind_logger = logging.getLogger('write_behind')
+
+
+class WriteBehindWriter(object):
+    """
+    延迟批量写入
+
+    add(instance) 缓存未保存的 model 实例，flush 时合并为多行 INSERT；
+    update(ids, **fields) 缓存状态变更，相同 fields 的变更合并为一条 UPDATE ... WHERE id IN (...)。
+    缓存数量达到 batch_size 或距离上次写入超过 flush_interval 秒时写入数据库。
+    """
+
+    def __init__(self, model, batch_size=200, flush_interval=1, max_pending=10000):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._inserts = []
+        self._updates = {}  # ((field, value), ...) -> [id, ...]
+        self._pending_updates = 0
+        self._event = Event()
+
+    def add(self, instance):
+        self._inserts.append(instance._data)
+        self._check_size()
+
+    def update(self, ids, **fields):
+        key = tuple(sorted(fields.items()))
+        self._updates.setdefault(key, []).extend(ids)
+        self._pending_updates += len(ids)
+        self._check_size()
+
+    def pending_count(self):
+        return len(self._inserts) + self._pending_updates
+
+    def _check_size(self):
+        if self.pending_count() >= self.batch_size:
+            self._event.set()
+
+    def run(self):
+        while True:
+            self._event.wait(timeout=self.flush_interval)
+            self._event.clear()
+            if not self.pending_count():
+                continue
+            try:
+                with db.execution_context(with_transaction=False):
+                    self.flush()
+            except Exception:
+                write_behind_logger.exception('write_behind_flush_failed')
+
+    def flush(self):
+        # 先整体取出缓存，写入期间新的数据进入新的缓存
+        chunks = self._insert_chunks(self._inserts)
+        updates = self._updates
+        self._inserts, self._updates, self._pending_updates = [], {}, 0
+
+        try:
+            while chunks:
+                self.model.insert_many(chunks[0]).execute()
+                chunks.pop(0)
+            # UPDATE 是幂等的，失败时整组重试
+            for key, ids in updates.items():
+                for i in range(0, len(ids), self.batch_size):
+                    self.model.update(**dict(key)).where(self.model.id.in_(ids[i:i+self.batch_size])).execute()
+                updates.pop(key)
+        except Exception:
+            self._restore([row for chunk in chunks for row in chunk], updates)
+            raise
+
+    def _insert_chunks(self, inserts):
+        # 字段不同的行不能放在同一条 INSERT 中
+        groups = {}
+        for row in inserts:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        chunks = []
+        for rows in groups.values():
+            for i in range(0, len(rows), self.batch_size):
+                chunks.append(rows[i:i+self.batch_size])
+        return chunks
+
+    def _restore(self, inserts, updates):
+        """写入失败时放回缓存，下次重试。超过 max_pending 时丢弃最旧的数据"""
+        self._inserts = inserts + self._inserts
+        for key, ids in updates.items():
+            self._updates.setdefault(key, [])[:0] = ids
+            self._pending_updates += len(ids)
+        dropped = len(self._inserts) - self.max_pending
+        if dropped > 0:
+            write_behind_logger.error('write_behind_dropped,%s' % dropped)
+            self._inserts = self._inserts[dropped:]
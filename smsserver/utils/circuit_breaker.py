@@ -0,0 +1,130 @@
+# coding: utf-8
+import time
+from collections import deque
+
+__all__ = ('CircuitBreaker', 'CircuitBreakerRegistry')
+
+
+class CircuitState(object):
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+
+class CircuitBreaker(object):
+    """
+    熔断器
+
+    closed: 统计最近 window 秒内的请求，请求数不少于 min_requests 且
+            失败率(超时也算失败)达到 error_rate 时转为 open
+    open: 拒绝所有请求，open_seconds 秒后转为 half_open
+    half_open: 最多放行 half_open_max_calls 个探测请求，
+               探测成功转为 closed，失败重新 open
+    """
+
+    BUCKETS = 10
+
+    def __init__(self, window=60, min_requests=10, error_rate=0.5, open_seconds=30, half_open_max_calls=1):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._bucket_width = float(window) / self.BUCKETS
+        self._buckets = deque()  # [bucket_start, success, failure, timeout]
+        self._state = CircuitState.closed
+        self._opened_at = 0
+        self._half_open_calls = 0
+
+    @property
+    def state(self):
+        if self._state == CircuitState.open and time.time() - self._opened_at >= self.open_seconds:
+            self._state, self._half_open_calls = CircuitState.half_open, 0
+        return self._state
+
+    def is_available(self):
+        """是否可以作为候选，不占用 half_open 的探测名额"""
+        state = self.state
+        if state == CircuitState.open:
+            return False
+        if state == CircuitState.half_open:
+            return self._half_open_calls < self.half_open_max_calls
+        return True
+
+    def allow_request(self):
+        """真正发送前调用，half_open 时占用一个探测名额"""
+        if not self.is_available():
+            return False
+        if self._state == CircuitState.half_open:
+            self._half_open_calls += 1
+        return True
+
+    def record_success(self):
+        if self.state == CircuitState.half_open:
+            self._close()
+        self._current_bucket()[1] += 1
+
+    def record_failure(self, is_timeout=False):
+        state = self.state
+        bucket = self._current_bucket()
+        bucket[2] += 1
+        if is_timeout:
+            bucket[3] += 1
+
+        if state == CircuitState.half_open:
+            self._open()
+        elif state == CircuitState.closed:
+            total, failure, __ = self._counts()
+            if total >= self.min_requests and failure >= total * self.error_rate:
+                self._open()
+
+    def stats(self):
+        total, failure, timeout = self._counts()
+        return {'state': self.state,
+                'total': total,
+                'failure': failure,
+                'timeout': timeout,
+                'error_rate': round(failure / float(total), 4) if total else 0}
+
+    def _open(self):
+        self._state, self._opened_at = CircuitState.open, time.time()
+
+    def _close(self):
+        self._state = CircuitState.closed
+        self._buckets.clear()
+
+    def _current_bucket(self):
+        now = time.time()
+        start = now - now % self._bucket_width
+        if not self._buckets or self._buckets[-1][0] != start:
+            self._buckets.append([start, 0, 0, 0])
+        self._expire(now)
+        return self._buckets[-1]
+
+    def _expire(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def _counts(self):
+        self._expire(time.time())
+        success = failure = timeout = 0
+        for __, s, f, t in self._buckets:
+            success, failure, timeout = success + s, failure + f, timeout + t
+        return success + failure, failure, timeout
+
+
+class CircuitBreakerRegistry(object):
+    """按 key 懒加载的熔断器集合，熔断器的参数相同"""
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+
+    def get(self, key):
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(**self.options)
+        return breaker
+
+    def stats(self):
+        return {key: breaker.stats() for key, breaker in self._breakers.items()}
@@ -0,0 +1,61 @@
+# coding: utf-8
+import os
+import string
+
+import gevent
+
+__all__ = ('CodeGenerator',)
+
+
+def _translate_table(alphabet):
+    """
+    字节到字符的映射表，大于 alphabet 长度整数倍的字节会被丢弃，避免取模带来的偏差
+    """
+    limit = 256 - 256 % len(alphabet)
+    table = (alphabet * (256 // len(alphabet) + 1))[:256]
+    deletechars = ''.join(chr(i) for i in range(limit, 256))
+    return table, deletechars
+
+
+def _random_strings(translate_table, length, count):
+    """用 os.urandom 批量生成 count 个长度为 length 的随机串"""
+    table, deletechars = translate_table
+    total = length * count
+    chars = ''
+    while len(chars) < total:
+        chars += os.urandom(total - len(chars) + 16).translate(table, deletechars)
+    return [chars[i:i+length] for i in range(0, total, length)]
+
+
+class CodeGenerator(object):
+    """
+    预先批量生成 (serial_number, code) 放入池中
+
+    池中剩余数量低于 pool_size * refill_ratio 时在后台补充，池为空时同步生成。
+    """
+
+    SERIAL_NUMBER_TABLE = _translate_table(string.ascii_letters + string.digits)
+    CODE_TABLE = _translate_table(string.digits)
+
+    def __init__(self, serial_number_length=16, code_length=6, pool_size=1000, refill_ratio=0.2):
+        self.serial_number_length = serial_number_length
+        self.code_length = code_length
+        self.pool_size = pool_size
+        self.refill_threshold = int(pool_size * refill_ratio)
+        self._pool = []
+        self._refilling = None
+
+    def generate_batch(self, count):
+        serial_numbers = _random_strings(self.SERIAL_NUMBER_TABLE, self.serial_number_length, count)
+        codes = _random_strings(self.CODE_TABLE, self.code_length, count)
+        return zip(serial_numbers, codes)
+
+    def _refill(self):
+        self._pool.extend(self.generate_batch(self.pool_size - len(self._pool)))
+
+    def get(self):
+        if not self._pool:
+            self._refill()
+        elif len(self._pool) <= self.refill_threshold and (self._refilling is None or self._refilling.ready()):
+            self._refilling = gevent.spawn(self._refill)
+        return self._pool.pop()
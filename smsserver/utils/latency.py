@@ -0,0 +1,27 @@
+# coding: utf-8
+from collections import deque
+
+__all__ = ('LatencyTracker',)
+
+
+class LatencyTracker(object):
+    """按 key 记录最近 size 次耗时，用于估算分位数"""
+
+    def __init__(self, size=200):
+        self.size = size
+        self._samples = {}
+
+    def record(self, key, seconds):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.size)
+        samples.append(seconds)
+
+    def percentile(self, key, percent, min_samples=20):
+        """样本不足 min_samples 时返回 None"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
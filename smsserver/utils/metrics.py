@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+statsd 打点
+
+tag 的格式与 FlaskStatsd 相同: name,k1=v1,k2=v2
+STATSD_ENABLED 为 False 时使用空实现，timer 返回同一个空的 context manager
+"""
+import time
+from functools import wraps
+
+from flask_statsd import add_tags
+from statsd import StatsClient
+from conf import Config
+
+__all__ = ('statsd_client', 'incr', 'timing', 'gauge', 'timer', 'timed')
+
+
+class _NullPipeline(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def incr(self, *args, **kw):
+        pass
+
+    def timing(self, *args, **kw):
+        pass
+
+    def gauge(self, *args, **kw):
+        pass
+
+
+class _NullStatsClient(_NullPipeline):
+
+    def pipeline(self):
+        return self
+
+
+class _Timer(object):
+    """记录 with 块的耗时(ms)，退出时有异常则 tag 中 error=异常类名"""
+
+    __slots__ = ('name', 'tags', 'start')
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        tags = self.tags
+        if exc_type is not None:
+            tags = dict(tags, error=exc_type.__name__)
+        statsd_client.timing(add_tags(self.name, **tags), (time.time() - self.start) * 1000)
+
+
+class _NullTimer(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def _create_client():
+    if not Config.STATSD_ENABLED:
+        return _NullStatsClient()
+    # 与 FlaskStatsd 使用相同的前缀
+    return StatsClient(host=Config.STATSD_HOST, port=Config.STATSD_PORT, prefix='smsserver', maxudpsize=1024)
+
+
+statsd_client = _create_client()
+enabled = Config.STATSD_ENABLED
+
+
+def incr(name, count=1, **tags):
+    if enabled:
+        statsd_client.incr(add_tags(name, **tags), count)
+
+
+def timing(name, ms, **tags):
+    if enabled:
+        statsd_client.timing(add_tags(name, **tags), ms)
+
+
+def gauge(name, value, **tags):
+    if enabled:
+        statsd_client.gauge(add_tags(name, **tags), value)
+
+
+def timer(name, **tags):
+    """with timer('provider.api_call', provider=1): ..."""
+    if enabled:
+        return _Timer(name, tags)
+    return _null_timer
+
+
+def timed(name, **tags):
+    """函数耗时，tag 固定"""
+    def decorator(func):
+        @wraps(func)
+        def _timed(*args, **kw):
+            with timer(name, **tags):
+                return func(*args, **kw)
+        return _timed
+    return decorator
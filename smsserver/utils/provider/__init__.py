@@ -1,8 +1,10 @@
 # coding: utf-8
+import gevent
 from smsserver.utils.provider.yunpian import YunPianV1Client
 from smsserver.utils.provider.dahansantong import DahanSanTongClient
 from smsserver.utils.provider.alidayu import ALiDaYuClient
-from smsserver.utils.provider.base import SMSSendFailed
+from smsserver.utils.provider.base import SMSSendFailed, SMSSendTimeout
+from smsserver.utils.provider.templates import TemplateRegistry
 from conf import Config
 
 
@@ -11,4 +13,19 @@ dahansantong_client = DahanSanTongClient(Config.DAHANSANTONG_ACCOUNT, Config.DAH
 alidayu_client = ALiDaYuClient(Config.ALIDAYU_KEY, Config.ALIDAYU_SECRET,
                                Config.ALIDAYU_TEMPLATES_DICT, Config.ALIDAYU_CALLED_SHOW_NUM)
 
-__all__ = ['SMSSendFailed', 'yunpianv1_client', 'dahansantong_client', 'alidayu_client']
+sms_templates = TemplateRegistry(Config.SMS_TEMPLATES)
+
+__all__ = ['SMSSendFailed', 'SMSSendTimeout', 'yunpianv1_client', 'dahansantong_client', 'alidayu_client',
+           'sms_templates', 'warm_up_clients', 'get_http_pool_stats']
+
+_clients = (yunpianv1_client, dahansantong_client, alidayu_client)
+
+
+def warm_up_clients(count):
+    """每个 client 预先建立 count 个连接"""
+    gevent.joinall([gevent.spawn(i.warm_up, count) for i in _clients])
+
+
+def get_http_pool_stats():
+    """hit_count 即复用连接省去的握手次数"""
+    return {i.session_pool.name: i.session_pool.stats() for i in _clients}
@@ -2,12 +2,22 @@
 import datetime
 from collections import OrderedDict
 from hmac import HMAC
+
+import simplejson
 from requests.exceptions import RequestException
 
 from smsserver.utils.provider.base import BaseClient, SMSSendFailed
+from smsserver.utils.provider.templates import CombinedMatcher
+
+SMS_CODE_KEYS = ('sms_template_code', 'sms_param')
+VOICE_CODE_KEYS = ('tts_code', 'tts_param')
 
 
 class ALiDaYuClient(BaseClient):
+    SEND_URL = 'https://eco.taobao.com/router/rest'
+    BATCH_MAX_SIZE = 200
+    WARM_UP_URLS = ('https://eco.taobao.com',)
+    TEMPLATE_KEY = 'alidayu'
     DIGITS_DICT = {'0': u'零', '1': u'一', '2': u'二', '3': u'三', '4': u'四',
                    '5': u'五', '6': u'六', '7': u'七', '8': u'八', '9': u'九'}
 
@@ -16,6 +26,8 @@ class ALiDaYuClient(BaseClient):
         self.secret = secret
         self.templates_dict = templates_dict
         self.called_show_num = called_show_num
+        # 纯文本发送时按配置的顺序匹配模板，预先合并成一个正则
+        self.matchers = {k: CombinedMatcher(v['templates']) for k, v in templates_dict.items()}
         super(ALiDaYuClient, self).__init__()
 
     def send_sms(self, country_code, phone_number, text):
@@ -25,6 +37,18 @@ class ALiDaYuClient(BaseClient):
         :param text: 文本内容
         :return: {'outid': u'z2c11bel02er'}
         """
+        return {'outid': self._send_sms(phone_number, self._text_map(text, 'sms', *SMS_CODE_KEYS))}
+
+    def send_template_sms(self, country_code, phone_number, template, params):
+        template_data = self._template_map(template, params, 'sms', *SMS_CODE_KEYS)
+        return {'outid': self._send_sms(phone_number, template_data)}
+
+    def batch_send_sms(self, country_code, phone_numbers, text):
+        outid = self._send_sms(','.join(phone_numbers), self._text_map(text, 'sms', *SMS_CODE_KEYS))
+        return {phone_number: outid for phone_number in phone_numbers}
+
+    def _send_sms(self, rec_num, template_data):
+        """rec_num 为逗号分隔的号码，template_data 为模板 id 和模板变量，返回 request_id"""
         data = {
             'app_key': self.apikey,
             'timestamp': datetime.datetime.now().strftime('%F %T'),
@@ -34,13 +58,19 @@ class ALiDaYuClient(BaseClient):
             'sms_type': 'normal',
             'sms_free_sign_name': u'下厨房',
             'method': 'alibaba.aliqin.fc.sms.num.send',
-            'rec_num': phone_number
+            'rec_num': rec_num
         }
-        data.update(self._text_map(text, self.templates_dict['sms']['templates'], 'sms_template_code', 'sms_param'))
+        data.update(template_data)
         data['sign'] = self._generate_signature(data)
-        return self._send(data, 'alibaba_aliqin_fc_sms_num_send_response')
+        return self._send(data, 'alibaba_aliqin_fc_sms_num_send_response')['outid']
 
     def send_voice(self, country_code, phone_number, text):
+        return self._send_voice(phone_number, self._text_map(text, 'voice', *VOICE_CODE_KEYS))
+
+    def send_template_voice(self, country_code, phone_number, template, params):
+        return self._send_voice(phone_number, self._template_map(template, params, 'voice', *VOICE_CODE_KEYS))
+
+    def _send_voice(self, phone_number, template_data):
         data = {
             'app_key': self.apikey,
             'timestamp': datetime.datetime.now().strftime('%F %T'),
@@ -51,13 +81,13 @@ class ALiDaYuClient(BaseClient):
             'called_num': phone_number,
             'called_show_num': self.called_show_num
         }
-        data.update(self._text_map(text, self.templates_dict['voice']['templates'], 'tts_code', 'tts_param'))
+        data.update(template_data)
         data['sign'] = self._generate_signature(data)
         return self._send(data, 'alibaba_aliqin_fc_tts_num_singlecall_response')
 
     def _send(self, data, response_key):
         try:
-            ret = self._requests_post(url='https://eco.taobao.com/router/rest', data=data, timeout=5).json()
+            ret = self._requests_post(self.SEND_URL, data=data, timeout=5).json()
         except RequestException as e:
             raise SMSSendFailed(str(e))
 
@@ -70,16 +100,35 @@ class ALiDaYuClient(BaseClient):
 
         return {'outid': ret[response_key]['request_id']}
 
-    def _text_map(self, text, templates, template_code_key, param_key):
+    def _text_map(self, text, service_key, template_code_key, param_key):
         """根据传入的 text 映射为阿里大于的模板 id && 模板变量"""
-        for template in templates:
-            result = template['regex'].search(text)
-            if result:
-                return {
-                    template_code_key: template['template_code'],
-                    param_key: template['params'] % self._params_filter(result.groups(), template)
-                }
-        raise SMSSendFailed(u'阿里大于 无法匹配模板: %s' % text)
+        template, groups = self.matchers[service_key].match(text)
+        if template is None:
+            raise SMSSendFailed(u'阿里大于 无法匹配模板: %s' % text)
+        return {
+            template_code_key: template['template_code'],
+            param_key: template['params'] % self._params_filter(groups, template)
+        }
+
+    def _template_map(self, template, params, service_key, template_code_key, param_key):
+        """
+        SMSTemplate 映射为阿里大于的模板 id && 模板变量，没有配置时按渲染后的文本匹配
+        配置: {'sms': {'template_code': '', 'params': ('code',)},
+               'voice': {'template_code': '', 'params': ('code',), 'to_chinese': ('code',)}}
+        """
+        native = (template.get_native(self.TEMPLATE_KEY) or {}).get(service_key)
+        if native is None:
+            return self._text_map(template.render(params), service_key, template_code_key, param_key)
+        try:
+            values = {k: unicode(params[k]) for k in native['params']}
+        except KeyError:
+            raise SMSSendFailed(u'模板参数错误: %s' % template.template_id)
+        for k in native.get('to_chinese', ()):
+            values[k] = self._digits_to_chinese(values[k])
+        return {
+            template_code_key: native['template_code'],
+            param_key: simplejson.dumps(values, ensure_ascii=False)
+        }
 
     def _generate_signature(self, data):
         ordered_data = OrderedDict(sorted(data.items(), key=lambda x: x[0]))
@@ -1,36 +1,84 @@
 # coding: utf-8
 import requests
-from threading import local
+from smsserver.utils import metrics
+from smsserver.utils.provider.pool import SessionPool
+from conf import Config
 
 
-class Local(local):
-    requests_session = None
+class SMSSendFailed(Exception):
+    pass
 
 
-class SMSSendFailed(Exception):
+class SMSSendTimeout(SMSSendFailed):
     pass
 
 
 class BaseClient(object):
+    # 单次批量发送最多支持的号码数
+    BATCH_MAX_SIZE = 1
+    # 是否支持主动拉取状态报告
+    PULL_STATUS_SUPPORTED = False
+    # 预热连接池时请求的地址
+    WARM_UP_URLS = ()
+    # Config.SMS_TEMPLATES 中服务商模板配置的 key
+    TEMPLATE_KEY = None
 
     def __init__(self, *args, **kw):
-        self.__local = Local()
+        # 所有 greenlet 共享，不能放在 threading.local 中，monkey patch 后会变成每个 greenlet 一个
+        self.session_pool = SessionPool(self.__class__.__name__, size=Config.HTTP_POOL_SIZE,
+                                        idle_timeout=Config.HTTP_POOL_IDLE_TIMEOUT)
 
-    def _get_request_session(self):
-        if self.__local.requests_session is None:
-            self.__local.requests_session = requests.Session()
-        return self.__local.requests_session
+    def _request(self, method, url, **kw):
+        # 未使用 stream，返回前已读完响应，连接可以直接归还
+        # 包括等待连接池的时间
+        with metrics.timer('provider_http.request', client=self.session_pool.name, method=method), \
+                self.session_pool.session() as session:
+            try:
+                return session.request(method, url, **kw)
+            except requests.exceptions.Timeout as e:
+                raise SMSSendTimeout(str(e))
 
-    def _requests_get(self, *args, **kw):
-        session = self._get_request_session()
-        return session.get(*args, **kw)
+    def _requests_get(self, url, params=None, **kw):
+        return self._request('GET', url, params=params, **kw)
 
-    def _requests_post(self, *args, **kw):
-        session = self._get_request_session()
-        return session.post(*args, **kw)
+    def _requests_post(self, url, data=None, **kw):
+        return self._request('POST', url, data=data, **kw)
+
+    def warm_up(self, count):
+        if self.WARM_UP_URLS:
+            self.session_pool.warm_up(self.WARM_UP_URLS, count)
 
     def send_sms(self, country_code, phone_number, text):
         raise NotImplementedError(u'client 不支持短信')
 
     def send_voice(self, country_code, phone_number, text):
         raise NotImplementedError(u'client 不支持语音')
+
+    def send_template_sms(self, country_code, phone_number, template, params):
+        """按 SMSTemplate 发送，服务商没有对应的模板时发送渲染后的文本"""
+        return self.send_sms(country_code, phone_number, template.render(params))
+
+    def send_template_voice(self, country_code, phone_number, template, params):
+        return self.send_voice(country_code, phone_number, template.render(params))
+
+    def batch_send_sms(self, country_code, phone_numbers, text):
+        """
+        同一内容发送给多个号码
+
+        返回值: {phone_number: outid}，不在返回值中的号码视为发送失败
+        """
+        raise NotImplementedError(u'client 不支持批量短信')
+
+    def pull_status(self, size=20):
+        """
+        拉取状态报告，已成功获取的数据不会再次返回
+
+        返回值: (has_more, status_list)
+        status_list: [{'sid': 短信id, 'receive_time': '接收时间', 'error_msg': '接收失败的原因',
+                       'mobile': '接收手机号', 'status': 'SUCCESS/FAIL/UNKNOWN'}]
+        """
+        raise NotImplementedError(u'client 不支持拉取状态报告')
+
+    def parse_status_callback(self, form):
+        """解析状态报告推送，返回值同 pull_status 的 status_list"""
+        raise NotImplementedError(u'client 不支持推送状态报告')
@@ -8,6 +8,8 @@ from smsserver.utils.provider.base import BaseClient, SMSSendFailed
 
 class DahanSanTongClient(BaseClient):
     SEND_URL = 'http://wt.3tong.net/http/sms/Submit'
+    BATCH_MAX_SIZE = 500
+    WARM_UP_URLS = ('http://wt.3tong.net',)
 
     def __init__(self, account, password):
         self.account = account
@@ -16,6 +18,14 @@ class DahanSanTongClient(BaseClient):
         super(DahanSanTongClient, self).__init__(account, password)
 
     def send_sms(self, country_code, phone_number, text):
+        return {'outid': self._submit([phone_number], text)}
+
+    def batch_send_sms(self, country_code, phone_numbers, text):
+        outid = self._submit(phone_numbers, text)
+        return {phone_number: outid for phone_number in phone_numbers}
+
+    def _submit(self, phone_numbers, text):
+        """提交短信，返回 msgid。多个号码以逗号分隔放在 <phones> 中"""
         xml_template = u'''<?xml version="1.0" encoding="UTF-8"?>
         <message>
             <account>%(account)s</account>
@@ -29,7 +39,7 @@ class DahanSanTongClient(BaseClient):
         </message>'''
         url = self.SEND_URL
         d = {'account': self.account, 'password': self.password_md5,
-             'phones': phone_number, 'content': text}
+             'phones': ','.join(phone_numbers), 'content': text}
         message = xml_template % d
         ret = {}
 
@@ -43,4 +53,4 @@ class DahanSanTongClient(BaseClient):
 
         if int(ret['result']) != 0:
             raise SMSSendFailed(u'大汉三通: %s %s' % (ret['result'], ret['desc']))
-        return {'outid': ret['msgid']}
+        return ret['msgid']
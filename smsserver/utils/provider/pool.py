@@ -0,0 +1,96 @@
+# coding: utf-8
+import time
+from contextlib import contextmanager
+
+import gevent
+import requests
+from gevent.lock import BoundedSemaphore
+from requests.adapters import HTTPAdapter
+from smsserver.utils import metrics
+
+__all__ = ('SessionPool',)
+
+
+class SessionPool(object):
+    """
+    多个 greenlet 共享的 requests.Session 池
+
+    每个 Session 对每个 host 只保持一个 keep-alive 连接，借出期间独占。
+    同时借出的数量不超过 size，超过时等待；空闲超过 idle_timeout 的 Session 会被关闭。
+    空闲的 Session 后进先出，尽量复用最近用过的连接。
+    """
+
+    def __init__(self, name, size=10, idle_timeout=60):
+        self.name = name
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._semaphore = BoundedSemaphore(size)
+        self._idle = []  # [(session, last_used)]，最近用过的在末尾
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evicted_count = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _evict(self, now):
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            session, _ = self._idle.pop(0)
+            session.close()
+            self.evicted_count += 1
+
+    def _checkout(self):
+        self._evict(time.time())
+        if self._idle:
+            self.hit_count += 1
+            metrics.incr('http_pool.hit', client=self.name)
+            return self._idle.pop()[0]
+        self.miss_count += 1
+        metrics.incr('http_pool.miss', client=self.name)
+        return self._new_session()
+
+    def _checkin(self, session):
+        self._idle.append((session, time.time()))
+
+    @contextmanager
+    def session(self):
+        start = time.time()
+        self._semaphore.acquire()
+        metrics.timing('http_pool.wait', (time.time() - start) * 1000, client=self.name)
+        try:
+            session = self._checkout()
+            try:
+                yield session
+            finally:
+                self._checkin(session)
+        finally:
+            self._semaphore.release()
+
+    def warm_up(self, urls, count):
+        """并发建立 count 个 Session，每个都请求一次 urls 以建立连接"""
+        def _connect(session):
+            for url in urls:
+                try:
+                    session.head(url, timeout=5)
+                except requests.exceptions.RequestException:
+                    pass
+
+        count = min(count, self.size) - len(self._idle)
+        sessions = [self._new_session() for _ in range(count)]
+        gevent.joinall([gevent.spawn(_connect, i) for i in sessions])
+        for session in sessions:
+            self._checkin(session)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': len(self._idle),
+            'in_use': self.size - self._semaphore.counter,
+            'hit_count': self.hit_count,
+            'miss_count': self.miss_count,
+            'evicted_count': self.evicted_count,
+        }
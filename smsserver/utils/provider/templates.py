@@ -0,0 +1,82 @@
+# coding: utf-8
+import re
+
+from smsserver.utils.provider.base import SMSSendFailed
+
+__all__ = ('SMSTemplate', 'TemplateRegistry', 'CombinedMatcher')
+
+
+class SMSTemplate(object):
+    """
+    逻辑模板
+
+    text: 文本格式，如 u'验证码：%(code)s'，用于不支持模板接口的服务商和 SMSRecord.text
+    providers: {client 的 TEMPLATE_KEY: 服务商模板配置}
+    """
+
+    def __init__(self, template_id, text, providers=None):
+        self.template_id = template_id
+        self.text = text
+        self.providers = providers or {}
+
+    def render(self, params):
+        try:
+            return self.text % params
+        except (KeyError, TypeError, ValueError):
+            raise SMSSendFailed(u'模板参数错误: %s' % self.template_id)
+
+    def get_native(self, key):
+        """服务商的模板配置，没有配置时返回 None"""
+        return self.providers.get(key)
+
+
+class TemplateRegistry(object):
+    """按 template_id 查找 SMSTemplate，配置见 Config.SMS_TEMPLATES"""
+
+    def __init__(self, templates_config):
+        self._templates = {}
+        for template_id, conf in templates_config.items():
+            conf = dict(conf)
+            self._templates[template_id] = SMSTemplate(template_id, conf.pop('text'), conf)
+
+    def __contains__(self, template_id):
+        return template_id in self._templates
+
+    def get(self, template_id):
+        try:
+            return self._templates[template_id]
+        except KeyError:
+            raise SMSSendFailed(u'模板不存在: %s' % template_id)
+
+
+class CombinedMatcher(object):
+    """
+    把多个正则合并成一个，一次匹配找到第一个能匹配的模板
+
+    每个正则前加上非贪婪的任意前缀，依次尝试各分支，优先级与逐个 search 相同。
+    """
+
+    def __init__(self, templates):
+        self.templates = list(templates)
+        parts, flags = [], 0
+        self._group_ranges = {}  # 分支外层分组的序号 -> (模板, 分支内第一个分组的序号, 最后一个分组的序号)
+        group_index = 1
+        for template in self.templates:
+            regex = template['regex']
+            if isinstance(regex, basestring):
+                regex = re.compile(regex)
+            parts.append(r'[\s\S]*?(%s)' % regex.pattern)
+            flags |= regex.flags
+            self._group_ranges[group_index] = (template, group_index + 1, group_index + regex.groups)
+            group_index += regex.groups + 1
+        self._regex = re.compile('|'.join(parts), flags) if parts else None
+
+    def match(self, text):
+        """返回值: (template, groups)，不能匹配时返回 (None, None)"""
+        if self._regex is None:
+            return None, None
+        result = self._regex.match(text)
+        if result is None:
+            return None, None
+        template, start, end = self._group_ranges[result.lastindex]
+        return template, tuple(result.group(i) for i in range(start, end + 1))
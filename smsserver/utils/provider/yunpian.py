@@ -1,28 +1,34 @@
 # coding: utf-8
 
 import requests
+import simplejson
 from urllib import urlencode
 from smsserver.utils.provider.base import BaseClient, SMSSendFailed
 
 
 class YunPianV1Client(BaseClient):
     DOMAIN = 'http://yunpian.com'
+    BATCH_SEND_URL = 'https://sms.yunpian.com/v2/sms/batch_send.json'
+    BATCH_MAX_SIZE = 1000
+    PULL_STATUS_SUPPORTED = True
+    TEMPLATE_KEY = 'yunpian'
+    WARM_UP_URLS = ('http://yunpian.com', 'https://sms.yunpian.com')
 
     def __init__(self, apikey):
         self.apikey = apikey
         super(YunPianV1Client, self).__init__(apikey)
 
+    def _format_mobile_and_text(self, country_code, phone_number, text):
+        if country_code == '86':
+            return phone_number, u'【下厨房】%s' % text
+        return '+%s%s' % (country_code, phone_number), u'【xiachufang】%s' % text
+
     def send_sms(self, country_code, phone_number, text):
         '''
         country_code:国家区号 phone_number:电话号码 text: 文本内容
         返回值: {'outid': xxx}
         '''
-        if country_code == '86':
-            mobile = phone_number
-            text = u'【下厨房】%s' % text
-        else:
-            mobile = '+%s%s' % (country_code, phone_number)
-            text = u'【xiachufang】%s' % text
+        mobile, text = self._format_mobile_and_text(country_code, phone_number, text)
 
         url = '%s/%s' % (self.DOMAIN, 'v1/sms/send.json')
         d = {'apikey': self.apikey, 'mobile': mobile, 'text': text}
@@ -37,6 +43,38 @@ class YunPianV1Client(BaseClient):
 
         return {'outid': ret['result']['sid']}
 
+    def batch_send_sms(self, country_code, phone_numbers, text):
+        '''
+        批量发送相同内容，使用 v2 batch_send 接口
+        返回值: {phone_number: outid}，单个号码失败时不在返回值中
+        '''
+        mobiles = {}
+        for phone_number in phone_numbers:
+            mobile, content = self._format_mobile_and_text(country_code, phone_number, text)
+            mobiles[mobile] = phone_number
+        d = {'apikey': self.apikey, 'mobile': ','.join(mobiles), 'text': content}
+
+        try:
+            ret = self._requests_post(self.BATCH_SEND_URL, data=d, timeout=10).json()
+        except requests.exceptions.RequestException as e:
+            raise SMSSendFailed(str(e))
+
+        if 'data' not in ret:
+            raise SMSSendFailed(u'云片: %s %s %s' % (ret.get('code'), ret.get('msg'), ret.get('detail')))
+
+        return {mobiles[i['mobile']]: i['sid'] for i in ret['data']
+                if i['code'] == 0 and i['mobile'] in mobiles}
+
+    def send_template_sms(self, country_code, phone_number, template, params):
+        '''
+        配置了云片模板时使用 tpl_send，模板变量名与 params 相同
+        配置: {'tpl_id': 1}
+        '''
+        native = template.get_native(self.TEMPLATE_KEY)
+        if native is None:
+            return super(YunPianV1Client, self).send_template_sms(country_code, phone_number, template, params)
+        return self.tpl_send(country_code, phone_number, native['tpl_id'], params)
+
     def tpl_send(self, country_code, phone_number, tpl_id, value):
         '''
         mobile: 国内电话号码 tpl_id: 模版id tpl_value: 模版变量
@@ -48,13 +86,17 @@ class YunPianV1Client(BaseClient):
             mobile = '+%s%s' % (country_code, phone_number)
 
         url = '%s/%s' % (self.DOMAIN, 'v1/sms/tpl_send.json')
-        _tpl_value_dict = {'#%s#' % k: v for k, v in value.iteritems()}
+        _tpl_value_dict = {('#%s#' % k).encode('utf-8'): unicode(v).encode('utf-8') for k, v in value.iteritems()}
         tpl_value = urlencode(_tpl_value_dict)
         d = {'apikey': self.apikey, 'mobile': mobile, 'tpl_id': tpl_id, 'tpl_value': tpl_value}
-        ret = self._requests_post(url, data=d, timeout=5).json()
+
+        try:
+            ret = self._requests_post(url, data=d, timeout=5).json()
+        except requests.exceptions.RequestException as e:
+            raise SMSSendFailed(str(e))
 
         if ret['code'] != 0:
-            raise SMSSendFailed(u'云片: %s %s %s' % (ret['code', ret['msg', ret['detail']]]))
+            raise SMSSendFailed(u'云片: %s %s %s' % (ret['code'], ret['msg'], ret['detail']))
 
         return {'outid': ret['result']['sid']}
 
@@ -73,10 +115,19 @@ class YunPianV1Client(BaseClient):
 
         _status_list = ret['sms_status']
         has_more = len(_status_list) == size
-        status_list = [{'sid': i['sid'], 'receive_time': i['user_receive_time'],
-                        'error_msg': i['error_msg'], 'mobile': i['mobile']}
-                       for i in _status_list]
-        return (has_more, status_list)
+        return (has_more, self._format_status_list(_status_list))
+
+    def _format_status_list(self, status_list):
+        return [{'sid': str(i['sid']), 'receive_time': i['user_receive_time'],
+                 'error_msg': i['error_msg'], 'mobile': i['mobile'], 'status': i['report_status']}
+                for i in status_list]
+
+    def parse_status_callback(self, form):
+        '''
+        状态报告推送，form 中的 sms_status 是 urlencode 后的 json 列表，字段与 pull_status 相同
+        推送方要求返回 SUCCESS
+        '''
+        return self._format_status_list(simplejson.loads(form['sms_status']))
 
     def pull_reply(self, size):
         '''
@@ -0,0 +1,69 @@
+# coding: utf-8
+import time
+
+__all__ = ('MemoryRateLimiter', 'RedisRateLimiter')
+
+
+class MemoryRateLimiter(object):
+    """
+    进程内令牌桶
+
+    每个 key 一个桶，容量为 capacity，每秒补充 rate 个令牌。
+    每 cleanup_interval 次调用清理一次已经补满的桶。
+    """
+
+    def __init__(self, cleanup_interval=10000):
+        self.cleanup_interval = cleanup_interval
+        self._buckets = {}  # key -> [tokens, timestamp, rate, capacity]
+        self._calls = 0
+
+    def allow(self, key, rate, capacity, cost=1):
+        now = time.time()
+        self._calls += 1
+        if self._calls % self.cleanup_interval == 0:
+            self._cleanup(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now, rate, capacity]
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        bucket[:] = [tokens, now, rate, capacity]
+        return allowed
+
+    def _cleanup(self, now):
+        for key in list(self._buckets):
+            tokens, timestamp, rate, capacity = self._buckets[key]
+            if tokens + (now - timestamp) * rate >= capacity:
+                del self._buckets[key]
+
+
+class RedisRateLimiter(object):
+    """多个进程共享的令牌桶，每个 key 一个 hash，补满后自动过期"""
+
+    _ALLOW_SCRIPT = '''
+    local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local now, cost = tonumber(ARGV[3]), tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+    local tokens = tonumber(bucket[1]) or capacity
+    local timestamp = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return allowed
+    '''
+
+    def __init__(self, redis_client, prefix='smsserver:rate_limit'):
+        self._redis = redis_client
+        self.prefix = prefix
+        self._allow = redis_client.register_script(self._ALLOW_SCRIPT)
+
+    def allow(self, key, rate, capacity, cost=1):
+        return bool(self._allow(keys=['%s:%s' % (self.prefix, key)], args=[rate, capacity, time.time(), cost]))
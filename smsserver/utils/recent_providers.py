@@ -0,0 +1,67 @@
+# coding: utf-8
+import time
+
+__all__ = ('MemoryRecentProviderStore', 'RedisRecentProviderStore')
+
+
+class MemoryRecentProviderStore(object):
+    """
+    进程内记录每个号码最近 window 秒内成功发送过的 provider
+
+    读写时清理当前号码的过期数据，每写入 cleanup_interval 次清理一次全部号码。
+    """
+
+    def __init__(self, window=1800, cleanup_interval=10000):
+        self.window = window
+        self.cleanup_interval = cleanup_interval
+        self._data = {}  # (country_code, phone_number) -> {provider_id: timestamp}
+        self._writes = 0
+
+    def add(self, country_code, phone_number, provider_id):
+        now = time.time()
+        self._data.setdefault((country_code, phone_number), {})[provider_id] = now
+        self._writes += 1
+        if self._writes % self.cleanup_interval == 0:
+            self._cleanup(now)
+
+    def get(self, country_code, phone_number):
+        key = (country_code, phone_number)
+        used = self._data.get(key)
+        if not used:
+            return []
+        past = time.time() - self.window
+        provider_ids = [pid for pid, timestamp in used.items() if timestamp > past]
+        if not provider_ids:
+            self._data.pop(key, None)
+        return provider_ids
+
+    def _cleanup(self, now):
+        past = now - self.window
+        for key in list(self._data):
+            if max(self._data[key].values()) <= past:
+                del self._data[key]
+
+
+class RedisRecentProviderStore(object):
+    """每个号码一个 zset，member 为 provider_id，score 为发送时间，整个 key 在 window 秒后过期"""
+
+    def __init__(self, redis_client, window=1800, prefix='smsserver:recent_providers'):
+        self._redis = redis_client
+        self.window = window
+        self.prefix = prefix
+
+    def _key(self, country_code, phone_number):
+        return '%s:%s:%s' % (self.prefix, country_code, phone_number)
+
+    def add(self, country_code, phone_number, provider_id):
+        key, now = self._key(country_code, phone_number), time.time()
+        pipe = self._redis.pipeline()
+        pipe.zadd(key, now, provider_id)
+        pipe.zremrangebyscore(key, '-inf', now - self.window)
+        pipe.expire(key, self.window)
+        pipe.execute()
+
+    def get(self, country_code, phone_number):
+        provider_ids = self._redis.zrangebyscore(self._key(country_code, phone_number),
+                                                 time.time() - self.window, '+inf')
+        return [int(i) for i in provider_ids]
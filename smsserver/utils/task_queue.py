@@ -0,0 +1,206 @@
+# coding: utf-8
+"""
+后台任务队列
+
+所有实现提供相同的接口:
+    put(task)                       task: (task_id, func, args, kw, enqueue_time)
+    get_batch(size, timeout)        取出最多 size 个任务，没有任务时最多等待 timeout 秒
+    ack(task_id)                    任务执行完毕
+    recover()                       把租约已过期(取出后未 ack)的任务放回队列
+    qsize()                         等待执行的任务数
+
+Redis 和 SQLite 实现会把任务持久化，取出的任务在 ack 前带有租约，
+进程崩溃或重启后租约过期的任务会被重新投递(at-least-once)。
+持久化的任务只能是模块级函数，参数需要能被 json 序列化。
+"""
+import importlib
+import sqlite3
+import time
+
+import gevent
+import simplejson
+from gevent.queue import Queue, Empty
+
+__all__ = ('MemoryTaskQueue', 'RedisTaskQueue', 'SQLiteTaskQueue')
+
+
+def _func_path(func):
+    return '%s:%s' % (func.__module__, func.__name__)
+
+
+def _resolve_func(path):
+    module, name = path.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def dumps_task(task):
+    task_id, func, args, kw, enqueue_time = task
+    return simplejson.dumps({'task_id': task_id, 'func': _func_path(func),
+                             'args': args, 'kw': kw, 'enqueue_time': enqueue_time})
+
+
+def loads_task(payload):
+    d = simplejson.loads(payload)
+    return d['task_id'], _resolve_func(d['func']), tuple(d['args']), d['kw'], d['enqueue_time']
+
+
+class MemoryTaskQueue(object):
+    """进程内队列，不做持久化"""
+
+    def __init__(self):
+        self._queue = Queue()
+
+    def put(self, task):
+        self._queue.put(task)
+
+    def get_batch(self, size, timeout=1):
+        try:
+            tasks = [self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()]
+        except Empty:
+            return []
+        while len(tasks) < size:
+            try:
+                tasks.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return tasks
+
+    def ack(self, task_id):
+        pass
+
+    def recover(self):
+        return 0
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class RedisTaskQueue(object):
+    """
+    {prefix}:pending   list，待执行的 task_id，LPUSH 入队 RPOP 出队
+    {prefix}:inflight  zset，已取出未 ack 的 task_id，score 为租约到期时间
+    {prefix}:payload   hash，task_id -> 序列化后的任务
+    """
+
+    POLL_INTERVAL = 0.05  # sec
+
+    _DEQUEUE_SCRIPT = '''
+    local ids = {}
+    for i = 1, tonumber(ARGV[1]) do
+        local task_id = redis.call('RPOP', KEYS[1])
+        if not task_id then break end
+        redis.call('ZADD', KEYS[2], ARGV[2], task_id)
+        ids[#ids + 1] = task_id
+    end
+    if #ids == 0 then return {} end
+    return redis.call('HMGET', KEYS[3], unpack(ids))
+    '''
+
+    _RECOVER_SCRIPT = '''
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, task_id in ipairs(ids) do
+        redis.call('ZREM', KEYS[2], task_id)
+        redis.call('RPUSH', KEYS[1], task_id)
+    end
+    return #ids
+    '''
+
+    def __init__(self, redis_client, prefix='smsserver:bgtask', lease_seconds=60):
+        self._redis = redis_client
+        self.lease_seconds = lease_seconds
+        self._keys = ['%s:pending' % prefix, '%s:inflight' % prefix, '%s:payload' % prefix]
+        self._dequeue = redis_client.register_script(self._DEQUEUE_SCRIPT)
+        self._recover = redis_client.register_script(self._RECOVER_SCRIPT)
+
+    def put(self, task):
+        pending, __, payload = self._keys
+        pipe = self._redis.pipeline()
+        pipe.hset(payload, task[0], dumps_task(task))
+        pipe.lpush(pending, task[0])
+        pipe.execute()
+
+    def get_batch(self, size, timeout=1):
+        deadline = time.time() + timeout
+        while True:
+            payloads = self._dequeue(keys=self._keys, args=[size, time.time() + self.lease_seconds])
+            if payloads or time.time() >= deadline:
+                # payload 为空说明任务已被 ack，直接丢弃
+                return [loads_task(i) for i in payloads if i]
+            gevent.sleep(self.POLL_INTERVAL)
+
+    def ack(self, task_id):
+        __, inflight, payload = self._keys
+        pipe = self._redis.pipeline()
+        pipe.zrem(inflight, task_id)
+        pipe.hdel(payload, task_id)
+        pipe.execute()
+
+    def recover(self):
+        return self._recover(keys=self._keys, args=[time.time()])
+
+    def qsize(self):
+        return self._redis.llen(self._keys[0])
+
+
+class SQLiteTaskQueue(object):
+    """
+    本地 SQLite 队列，适合单机部署和测试
+
+    lease_until 为 0 表示待执行，小于当前时间表示租约已过期，
+    这两种任务都会被 get_batch 取出。
+    """
+
+    POLL_INTERVAL = 0.05  # sec
+
+    def __init__(self, path, lease_seconds=60, table='bgtask'):
+        self.lease_seconds = lease_seconds
+        self._table = table
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._execute('''CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL UNIQUE,
+            payload TEXT NOT NULL,
+            lease_until REAL NOT NULL DEFAULT 0
+        )''')
+        self._execute('CREATE INDEX IF NOT EXISTS {table}_lease_until ON {table} (lease_until)')
+
+    def _execute(self, sql, params=()):
+        return self._conn.execute(sql.format(table=self._table), params)
+
+    def put(self, task):
+        self._execute('INSERT INTO {table} (task_id, payload) VALUES (?, ?)', (task[0], dumps_task(task)))
+
+    def _dequeue(self, size):
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._execute('SELECT id, payload FROM {table} WHERE lease_until < ? ORDER BY id LIMIT ?',
+                                 (now, size)).fetchall()
+            if rows:
+                self._execute('UPDATE {table} SET lease_until = ? WHERE id IN (%s)' % ','.join('?' * len(rows)),
+                                   [now + self.lease_seconds] + [i[0] for i in rows])
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        return [loads_task(payload) for __, payload in rows]
+
+    def get_batch(self, size, timeout=1):
+        deadline = time.time() + timeout
+        while True:
+            tasks = self._dequeue(size)
+            if tasks or time.time() >= deadline:
+                return tasks
+            gevent.sleep(self.POLL_INTERVAL)
+
+    def ack(self, task_id):
+        self._execute('DELETE FROM {table} WHERE task_id = ?', (task_id,))
+
+    def recover(self):
+        cursor = self._execute('UPDATE {table} SET lease_until = 0 WHERE lease_until > 0 AND lease_until < ?',
+                               (time.time(),))
+        return cursor.rowcount
+
+    def qsize(self):
+        return self._execute('SELECT COUNT(*) FROM {table} WHERE lease_until = 0').fetchone()[0]
@@ -1,64 +1,77 @@
 # coding: utf-8
 import random
+from bisect import bisect_right
+from math import log
+from operator import itemgetter
 
-__all__ = ('weighted_shuffle',)
+__all__ = ('weighted_shuffle', 'WeightedSampler')
 
+_first = itemgetter(0)
+_second = itemgetter(1)
 
-class Node(object):
 
-    def __init__(self, value=None, weight=None, left=None, right=None):
-        self.value = value
-        self.weight = weight
-        self.left = left
-        self.right = right
-
-    def is_leaf(self):
-        return self.left is None and self.right is None
-
-
-def _weighted_node(a, b):
+def weighted_shuffle(choices):
     """
-    生成 a, b 两个节点的父节点
+    按一定的权重打乱元素的顺序
 
-    a.weight/(a.weight+b.weight) 的概率 a 在 b 的左边
-    b.weight/(a.weight+b.weight) 的概率 b 在 a 的左边
+    每个元素取 expovariate(weight) 作为 key 按升序排列，相当于按权重依次不放回抽取，
+    第一个元素是 value 的概率为 weight/sum(weights)。
+    权重为 0 的元素随机排在最后。不修改传入的 choices。
+
+    Args:
+        choices: (value, weight) 组成的列表
+    Returns:
+        打乱顺序后的 value 列表
     """
-    total = a.weight + b.weight
-    r = random.uniform(0, total)
-    if r < a.weight:
-        return Node(None, total, left=a, right=b)
-    else:
-        return Node(None, total, left=b, right=a)
+    expovariate = random.expovariate
+    keyed, zeros = [], []
+    for value, weight in choices:
+        if weight > 0:
+            keyed.append((expovariate(weight), value))
+        else:
+            zeros.append(value)
+    keyed.sort(key=_first)
+    result = map(_second, keyed)
+    if zeros:
+        random.shuffle(zeros)
+        result.extend(zeros)
+    return result
 
 
-def _tree(choices):
-    length = len(choices)
-    if length == 0:
-        return None
-    elif length == 1:
-        value, weight = choices[0]
-        return Node(value, weight)
-    else:
-        middle = int(length/2)
-        return _weighted_node(_tree(choices[:middle]), _tree(choices[middle:]))
+class WeightedSampler(object):
+    """
+    同一组 choices 多次抽取时使用，预先计算好权重的倒数和累计权重
 
+    shuffle 的结果与 weighted_shuffle 同分布，choice 只取第一个元素，O(log n)
+    """
 
-def _flatten(tree):
-    if tree is None:
-        return []
-    if tree.is_leaf():
-        return [tree.value]
-    return _flatten(tree.left) + _flatten(tree.right)
+    def __init__(self, choices):
+        self.choices = choices
+        self._values = [value for value, weight in choices if weight > 0]
+        self._inverse_weights = [1.0 / weight for value, weight in choices if weight > 0]
+        self._zeros = [value for value, weight in choices if weight <= 0]
+        self._cumulative_weights = []
+        total = 0.0
+        for value, weight in choices:
+            if weight > 0:
+                total += weight
+                self._cumulative_weights.append(total)
+        self._total_weight = total
 
+    def shuffle(self):
+        rand = random.random
+        keys = [-log(1.0 - rand()) * i for i in self._inverse_weights]
+        values = self._values
+        result = [values[i] for i in sorted(range(len(keys)), key=keys.__getitem__)]
+        if self._zeros:
+            zeros = list(self._zeros)
+            random.shuffle(zeros)
+            result.extend(zeros)
+        return result
 
-def weighted_shuffle(choices):
-    """
-    按一定的权重打乱元素的顺序
+    def choice(self):
+        if not self._values:
+            return random.choice(self._zeros) if self._zeros else None
+        index = bisect_right(self._cumulative_weights, random.random() * self._total_weight)
+        return self._values[min(index, len(self._values) - 1)]
 
-    Args:
-        choices: (value, weight) 组成的列表
-    Returns:
-        打乱顺序后的 value 列表
-    """
-    random.shuffle(choices)
-    return _flatten(_tree(choices))
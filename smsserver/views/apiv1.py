@@ -3,9 +3,12 @@ import logging
 import simplejson
 from flask import Blueprint
 from flask import request
-from smsserver.models.sms_verification import SMSVerification
-from smsserver.models.sms_center import SMSSendFailed, SMSCenter
-from smsserver.views.viewlibs.decorator import apiv1_signed
+from smsserver.models.verification_store import verification_store
+from smsserver.models.sms_center import SMSSendFailed, SMSCenter, SMSProvider
+from smsserver.models.delivery_report import delivery_reports
+from smsserver.bgtask import BGTaskQueueFull
+from smsserver.utils.provider import sms_templates
+from smsserver.views.viewlibs.decorator import apiv1_rate_limited, apiv1_signed
 from smsserver.views.viewlibs.render import error, ok
 from smsserver.views.viewlibs.errors import Apiv1Error
 from conf import Config
@@ -20,20 +23,42 @@ apiv1_logger = logging.getLogger('apiv1')
 
 @bp.route('/message/send.json', methods=['POST'])
 @apiv1_signed
+@apiv1_rate_limited('message_send')
 def send_plain_text():
+    """
+    text 和 template_id 二选一
+    template_id: Config.SMS_TEMPLATES 中的模板，params 为 JSON 格式的模板变量
+    """
     country_code = request.form.get('country_code', '').strip()
     phone_number = request.form.get('phone_number', '').strip()
     text = request.form.get('text', '').strip()
+    template_id = request.form.get('template_id', '').strip()
     is_async = request.form.get('mode', 'async').strip() == 'async'
     is_sms = request.form.get('send_mode', 'sms').strip() == 'sms'
+    is_hedged = request.form.get('hedged', '0').strip() == '1'
 
-    if not all([country_code, phone_number, text]):
+    if not all([country_code, phone_number]) or not (text or template_id):
         apiv1_logger.error(u'send_plain_text,%s,%s' % (Apiv1Error.not_all_parameters_provided[0],
                                                        simplejson.dumps(request.form)))
         return error(Apiv1Error.not_all_parameters_provided)
 
+    if template_id:
+        try:
+            params = simplejson.loads(request.form.get('params', '') or '{}')
+            text = sms_templates.get(template_id).render(params)
+        except (ValueError, SMSSendFailed):
+            apiv1_logger.error(u'send_plain_text,%s,%s' % (Apiv1Error.invalid_template[0],
+                                                           simplejson.dumps(request.form)))
+            return error(Apiv1Error.invalid_template)
+    else:
+        template_id, params = None, None
+
     try:
-        SMSCenter.send(country_code, phone_number, text, is_async=is_async, is_sms=is_sms)
+        SMSCenter.send(country_code, phone_number, text, is_async=is_async, is_sms=is_sms, is_hedged=is_hedged,
+                       template_id=template_id, params=params)
+    except BGTaskQueueFull:
+        apiv1_logger.error(u'send_plain_text,%s,%s' % (Apiv1Error.service_busy[0], simplejson.dumps(request.form)))
+        return error(Apiv1Error.service_busy, 503)
     except SMSSendFailed as e:
         apiv1_logger.error(u'send_plain_text,%s,%s' % (e.message, simplejson.dumps(request.form)))
         return error(Apiv1Error.send_plain_text_failed)
@@ -41,23 +66,76 @@ def send_plain_text():
     return ok()
 
 
+@bp.route('/message/batch_send.json', methods=['POST'])
+@apiv1_signed
+@apiv1_rate_limited('message_batch_send')
+def batch_send_plain_text():
+    """
+    批量发送短信，异步发送，返回 job_id
+
+    phone_numbers: 逗号分隔的号码，所有号码发送相同的 text
+    recipients: JSON 列表 [{"phone_number": "...", "params": {...}}]，
+                text 作为模板，如 u'%(name)s 你好'，按每个号码的 params 渲染
+    """
+    country_code = request.form.get('country_code', '').strip()
+    text = request.form.get('text', '').strip()
+    phone_numbers = request.form.get('phone_numbers', '').strip()
+    recipients_json = request.form.get('recipients', '').strip()
+
+    if not all([country_code, text]) or not (phone_numbers or recipients_json):
+        apiv1_logger.error(u'batch_send_plain_text,%s,%s' % (Apiv1Error.not_all_parameters_provided[0],
+                                                             simplejson.dumps(request.form)))
+        return error(Apiv1Error.not_all_parameters_provided)
+
+    if phone_numbers:
+        recipients = [(i.strip(), text) for i in phone_numbers.split(',') if i.strip()]
+    else:
+        try:
+            recipients = [(i['phone_number'].strip(), text % i.get('params', {}))
+                          for i in simplejson.loads(recipients_json)]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            apiv1_logger.error(u'batch_send_plain_text,%s,%s' % (Apiv1Error.parameter_type_error[0],
+                                                                 simplejson.dumps(request.form)))
+            return error(Apiv1Error.parameter_type_error)
+
+    if len(recipients) > Config.BATCH_SEND_MAX_RECIPIENTS:
+        return error(Apiv1Error.too_many_recipients)
+
+    try:
+        job_id = SMSCenter.batch_send(country_code, recipients)
+    except BGTaskQueueFull:
+        apiv1_logger.error(u'batch_send_plain_text,%s,%s' % (Apiv1Error.service_busy[0], country_code))
+        return error(Apiv1Error.service_busy, 503)
+    except SMSSendFailed as e:
+        apiv1_logger.error(u'batch_send_plain_text,%s,%s' % (e.message, country_code))
+        return error(Apiv1Error.send_plain_text_failed)
+
+    return ok({'job_id': job_id, 'count': len(recipients)})
+
+
 @bp.route('/verification/send.json', methods=['POST'])
 @apiv1_signed
+@apiv1_rate_limited('verification_send')
 def phone_send_verification_code():
     country_code = request.form.get('country_code', '').strip()
     phone_number = request.form.get('phone_number', '').strip()
     is_async = request.form.get('mode', 'async').strip() == 'async'
     is_sms = request.form.get('send_mode', 'sms').strip() == 'sms'
+    is_hedged = request.form.get('hedged', '0').strip() == '1'
 
     if not all([country_code, phone_number]):
         apiv1_logger.error(u'send_verification_code,%s,%s' % (Apiv1Error.not_all_parameters_provided[0],
                                                               simplejson.dumps(request.form)))
         return error(Apiv1Error.not_all_parameters_provided)
 
-    sms_verification = SMSVerification.create_or_get_unused_verification_code(country_code, phone_number)
+    sms_verification = verification_store.create_or_get_unused_verification_code(country_code, phone_number)
 
     try:
-        sms_verification.send(is_async=is_async, is_sms=is_sms)
+        sms_verification.send(is_async=is_async, is_sms=is_sms, is_hedged=is_hedged)
+    except BGTaskQueueFull:
+        apiv1_logger.error(u'send_verification_code,%s,%s' % (Apiv1Error.service_busy[0],
+                                                              simplejson.dumps(request.form)))
+        return error(Apiv1Error.service_busy, 503)
     except SMSSendFailed as e:
         apiv1_logger.error(u'send_verification_code,%s,%s,%s' % (Apiv1Error.send_verification_code_failed[0],
                                                                  simplejson.dumps(request.form), e.message))
@@ -74,6 +152,7 @@ def phone_send_verification_code():
 
 @bp.route('/verification/verify.json', methods=['POST'])
 @apiv1_signed
+@apiv1_rate_limited('verification_verify')
 def verify_code():
     country_code = request.form.get('country_code', '').strip()
     phone_number = request.form.get('phone_number', '').strip()
@@ -89,8 +168,30 @@ def verify_code():
     if Config.DEBUG and code == '000000':
         return ok()
 
-    if not SMSVerification.verify(country_code, phone_number, code):
+    if not verification_store.verify(country_code, phone_number, code):
         apiv1_logger.error(u'verify_code,%s,%s' % (Apiv1Error.invalid_verification_code[0],
                                                    simplejson.dumps(request.form)))
         return error(Apiv1Error.invalid_verification_code)
     return ok()
+
+
+@bp.route('/delivery_report/<int:provider_id>.json', methods=['POST'])
+def receive_delivery_report(provider_id):
+    """
+    服务商推送状态报告，不使用 apiv1_signed，
+    在服务商后台配置的回调地址中带上 token=DELIVERY_REPORT_CALLBACK_TOKEN
+    """
+    token = Config.DELIVERY_REPORT_CALLBACK_TOKEN
+    if not token or request.args.get('token', '') != token:
+        return error(Apiv1Error.signature_error, 403)
+
+    try:
+        provider = SMSProvider.get(id=provider_id)
+        status_list = provider.api_client.parse_status_callback(request.form)
+    except (SMSProvider.DoesNotExist, NotImplementedError, KeyError, ValueError) as e:
+        apiv1_logger.error(u'receive_delivery_report,%s,%s' % (provider_id, e))
+        return error(Apiv1Error.parameter_type_error)
+
+    delivery_reports.add(provider_id, status_list)
+    # 云片要求返回 SUCCESS，否则会重试推送
+    return 'SUCCESS'
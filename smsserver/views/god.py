@@ -1,12 +1,15 @@
 # coding: utf-8
 import simplejson
 import datetime
-from itertools import groupby
 from flask import Blueprint, request, jsonify
 from flask.ext.mako import render_template
-from smsserver.models.sms_center import SMSProvider, SMSRecord
+from smsserver.models.sms_center import SMSProvider, SMSRecord, circuit_breakers, routing_table
 from smsserver.models.const import SMSSendStatus
+from smsserver.models.sms_stats import get_send_counts_by_phone_number, get_send_counts_by_provider
 from smsserver.bgtask import get_bgtasks_stats
+from smsserver.utils.provider import get_http_pool_stats
+from smsserver.views.viewlibs.render import stream_template
+from conf import Config
 
 
 __all__ = ['bp']
@@ -26,7 +29,13 @@ def interface_balance():
     for i in SMSProvider.select():
         providers.append({'name': i.name, 'weight': i.weight, 'id': i.id})
 
-    return render_template('interface_balance.html', sms_providers=providers)
+    # 当前进程内的熔断状态
+    names = {i['id']: i['name'] for i in providers}
+    breakers = []
+    for (pid, service_key), stats in sorted(circuit_breakers.stats().items()):
+        breakers.append(dict(stats, name=names.get(pid, pid), service_key=service_key))
+
+    return render_template('interface_balance.html', sms_providers=providers, circuit_breakers=breakers)
 
 
 @bp.route('/interface_balance/set', methods=['POST'])
@@ -35,57 +44,97 @@ def set_interface_balance():
     for pid, weight in simplejson.loads(data).iteritems():
         provider = SMSProvider.get(id=pid)
         provider.set_weight(weight)
+    routing_table.invalidate()
 
     return jsonify({})
 
 
-def _sms_send_sort_by_phone_number(start_time):
-    sms_recors = SMSRecord.select().where((SMSRecord.status == SMSSendStatus.success) &
-                                          (SMSRecord.create_time > start_time)).order_by(SMSRecord.phone_number)
-    l = []
-    for k, b in groupby(sms_recors, lambda x: x.phone_number):
-        record_num = len(list(b))
-        if record_num >= 2:
-            l.append((k, record_num))
-    l.sort(key=lambda x: x[1], reverse=True)
-    return l
-
-
-def _sms_send_status_by_provider(start_time, provider):
-    success_num = SMSRecord.select().where((SMSRecord.status == SMSSendStatus.success) &
-                                          (SMSRecord.provider_id == provider.id) &
-                                          (SMSRecord.create_time > start_time)).count()
-
-    total = SMSRecord.select().where((SMSRecord.status == SMSSendStatus.success) &
-                                     (SMSRecord.create_time > start_time)).count()
-    return '%s / %s' % (success_num, total)
+def _sms_send_status_by_provider(start_time, providers):
+    counts = get_send_counts_by_provider(start_time)
+    total = sum(i.get(SMSSendStatus.success, 0) for i in counts.values())
+    return [(i.name, '%s / %s' % (counts.get(i.id, {}).get(SMSSendStatus.success, 0), total)) for i in providers]
 
 
 @bp.route('/statistics')
 def statistics():
+    """只读取预先汇总的统计表，时间范围按小时(接口)和天(号码)对齐"""
     now = datetime.datetime.now()
     data = []
 
     one_day_before = now - datetime.timedelta(days=1)
     one_week_before = now - datetime.timedelta(days=7)
 
-    providers = SMSProvider.select()
+    providers = list(SMSProvider.select())
 
-    data.append((u'一天内短信接口发送统计(成功/总数)', [(i.name, _sms_send_status_by_provider(one_day_before, i)) for i in providers]))
-    data.append((u'一周内短信接口发送统计(成功/总数)', [(i.name, _sms_send_status_by_provider(one_week_before, i)) for i in providers]))
-    data.append((u'一天内号码发送统计', _sms_send_sort_by_phone_number(one_day_before)))
-    data.append((u'一周内号码发送统计', _sms_send_sort_by_phone_number(one_week_before)))
+    data.append((u'一天内短信接口发送统计(成功/总数)', _sms_send_status_by_provider(one_day_before, providers)))
+    data.append((u'一周内短信接口发送统计(成功/总数)', _sms_send_status_by_provider(one_week_before, providers)))
+    data.append((u'一天内号码发送统计', get_send_counts_by_phone_number(one_day_before)))
+    data.append((u'一周内号码发送统计', get_send_counts_by_phone_number(one_week_before)))
 
     return render_template('statistics.html', data=data)
 
 
+def _parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class _RecordPage(object):
+    """惰性读取一页记录，遍历结束后 next_cursor 为下一页的 (before_time, before_id)"""
+
+    def __init__(self, query, page_size):
+        self.query = query
+        self.page_size = page_size
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for i, record in enumerate(self.query.limit(self.page_size + 1).iterator()):
+            if i == self.page_size:
+                self.next_cursor = (last.create_time.strftime('%Y-%m-%d %H:%M:%S'), last.id)
+                break
+            last = record
+            yield record
+
+
 @bp.route('/query')
 def query():
-    phone_number = request.args.get('phone_number', '')
-    records = SMSRecord.select().where(SMSRecord.phone_number == phone_number).order_by(SMSRecord.create_time.desc())
-    return render_template('query.html', records=records)
+    """按 (create_time, id) 倒序分页，依赖 sms_record (phone_number, create_time, id) 索引"""
+    filters = dict((k, v) for k, v in request.args.items()
+                   if k in ('phone_number', 'provider_id', 'status', 'start_time', 'end_time') and v)
+    phone_number = filters.get('phone_number', '')
+    condition = SMSRecord.phone_number == phone_number
+    if filters.get('provider_id', '').isdigit():
+        condition &= SMSRecord.provider_id == int(filters['provider_id'])
+    if filters.get('status', '').isdigit():
+        condition &= SMSRecord.status == int(filters['status'])
+    start_time = _parse_time(filters.get('start_time', ''))
+    if start_time:
+        condition &= SMSRecord.create_time >= start_time
+    end_time = _parse_time(filters.get('end_time', ''))
+    if end_time:
+        condition &= SMSRecord.create_time < end_time
+
+    before_time = _parse_time(request.args.get('before_time', ''))
+    before_id = request.args.get('before_id', '')
+    if before_time and before_id.isdigit():
+        condition &= (SMSRecord.create_time < before_time) | (
+            (SMSRecord.create_time == before_time) & (SMSRecord.id < int(before_id)))
+
+    records = SMSRecord.select().where(condition).order_by(SMSRecord.create_time.desc(), SMSRecord.id.desc())
+    return stream_template('query.html', records=_RecordPage(records, Config.QUERY_PAGE_SIZE), filters=filters,
+                           providers=list(SMSProvider.select()), SMSSendStatus=SMSSendStatus)
 
 
 @bp.route('/bgtask-stats')
 def bgtask_stats():
     return jsonify(get_bgtasks_stats())
+
+
+@bp.route('/http-pool-stats')
+def http_pool_stats():
+    return jsonify(get_http_pool_stats())
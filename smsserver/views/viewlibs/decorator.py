@@ -1,14 +1,30 @@
 # coding: utf8
 import hashlib
+import logging
+import redis
 from operator import itemgetter
 from decimal import Decimal
 from functools import wraps
 from flask import request
+from smsserver.utils import metrics
+from smsserver.utils.rate_limit import MemoryRateLimiter, RedisRateLimiter
 from smsserver.views.viewlibs.render import error
 from smsserver.views.viewlibs.errors import Apiv1Error
 from conf import Config
 
 
+rate_limit_logger = logging.getLogger('rate_limit')
+
+
+def _create_rate_limiter():
+    if Config.RATE_LIMIT_BACKEND == 'redis':
+        return RedisRateLimiter(redis.StrictRedis.from_url(Config.REDIS_URL))
+    return MemoryRateLimiter()
+
+
+rate_limiter = _create_rate_limiter()
+
+
 def compute_sign(d, secret_key):
     md5_str = ''
 
@@ -44,7 +60,47 @@ def apiv1_signed(func):
             for k, v in request.args.iteritems():
                 d[k] = v
 
-        if verify_sign(d):
+        with metrics.timer('apiv1.verify_sign'):
+            is_valid = verify_sign(d)
+        if is_valid:
             return func(*args, **kwargs)
         return error(Apiv1Error.signature_error, 401)
     return _signed
+
+
+def _rate_limit_keys(scope):
+    """按 RATE_LIMITS[scope] 中配置的维度生成 (key, 次数, 秒数)"""
+    limits = Config.RATE_LIMITS.get(scope, {})
+    values = {
+        'ip': request.remote_addr,
+        'client': request.values.get('public_key', '').strip(),
+    }
+    country_code = request.values.get('country_code', '').strip()
+    phone_number = request.values.get('phone_number', '').strip()
+    if country_code and phone_number:
+        values['phone'] = '%s:%s' % (country_code, phone_number)
+
+    for dimension, (count, seconds) in limits.iteritems():
+        value = values.get(dimension)
+        if value:
+            yield '%s:%s:%s' % (scope, dimension, value), count, seconds
+
+
+def apiv1_rate_limited(scope):
+    """令牌桶限流，在访问数据库之前执行。限流存储不可用时放行"""
+    def decorator(func):
+        @wraps(func)
+        def _rate_limited(*args, **kwargs):
+            for key, count, seconds in _rate_limit_keys(scope):
+                try:
+                    allowed = rate_limiter.allow(key, count / float(seconds), count)
+                except redis.RedisError as e:
+                    rate_limit_logger.error('rate_limit_failed,%s,%s' % (key, e))
+                    continue
+                if not allowed:
+                    rate_limit_logger.warning('rate_limited,%s' % key)
+                    metrics.incr('apiv1.rate_limited', scope=scope)
+                    return error(Apiv1Error.rate_limited, 429)
+            return func(*args, **kwargs)
+        return _rate_limited
+    return decorator
@@ -5,8 +5,12 @@ class Apiv1Error(object):
     signature_error = (1000, 'signature error')
     parameter_type_error = (1001, 'parameter type error')
     not_all_parameters_provided = (1002, 'not all parameters provided')
+    service_busy = (1003, 'service busy, please retry later')
+    rate_limited = (1004, 'rate limit exceeded')
 
     invalid_verification_code = (2000, 'invalid verification code')
     send_verification_code_failed = (2001, 'send_verification_code_failed')
 
     send_plain_text_failed = (2002, 'send_plain_text_failed')
+    too_many_recipients = (2003, 'too many recipients')
+    invalid_template = (2004, 'invalid template or params')
@@ -1,5 +1,10 @@
 # coding: utf8
-from flask import jsonify
+import gevent
+from gevent.queue import Queue
+from flask import Response, copy_current_request_context, current_app, jsonify
+from flask.ext.mako import _lookup
+from mako.runtime import Context
+from smsserver.models import db
 
 
 def ok(content='', status_code=200):
@@ -25,3 +30,61 @@ def error(error='', status_code=400):
     response = jsonify(msg)
     response.status_code = status_code
     return response
+
+
+class _QueueBuffer(object):
+    """攒够 chunk_size 后放入队列，队列满时渲染的 greenlet 会等待"""
+
+    def __init__(self, queue, chunk_size):
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self._chunks = []
+        self._size = 0
+
+    def write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self.queue.put(u''.join(self._chunks).encode('utf-8'))
+            self._chunks, self._size = [], 0
+
+
+def stream_template(template_name, chunk_size=8192, **context):
+    """
+    边渲染边输出 mako 模板，context 中可以传入惰性的查询
+
+    模板在单独的 greenlet 中渲染，使用单独的数据库连接
+    """
+    app = current_app._get_current_object()
+    template = _lookup(app).get_template(template_name)
+    context.update(app.jinja_env.globals)
+    app.update_template_context(context)
+
+    queue = Queue(maxsize=4)
+    buf = _QueueBuffer(queue, chunk_size)
+
+    @copy_current_request_context
+    def _render():
+        try:
+            with db.execution_context(with_transaction=False):
+                template.render_context(Context(buf, **context))
+            buf.flush()
+            queue.put(StopIteration)
+        except Exception as e:
+            queue.put(e)
+
+    def _generate():
+        greenlet = gevent.spawn(_render)
+        try:
+            for chunk in queue:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            greenlet.kill()
+
+    return Response(_generate(), mimetype='text/html')
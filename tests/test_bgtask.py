@@ -0,0 +1,82 @@
+# coding: utf-8
+import time
+
+import gevent
+from gevent.event import Event
+from pytest import raises
+from smsserver.bgtask import BGTaskLane, BGTaskManager, BGTaskQueueFull, manager, spawn_bgtask
+from smsserver.utils.task_queue import MemoryTaskQueue
+
+
+def _task(result):
+    result.append(1)
+
+
+def _record(result, name, event=None):
+    if event is not None:
+        event.wait()
+    result.append(name)
+
+
+def _create_manager(max_workers, **lanes):
+    lanes = [BGTaskLane(name, MemoryTaskQueue(), weight=weight, reserved_workers=reserved)
+             for name, (weight, reserved) in sorted(lanes.items())]
+    return BGTaskManager(max_workers, lanes, batch_size=100)
+
+
+def test_spawn_bgtask_queue_full(monkeypatch):
+    monkeypatch.setattr(manager, 'max_queue_size', 0)
+    rejected_count = manager.rejected_count
+    with raises(BGTaskQueueFull):
+        spawn_bgtask(_task, [])
+    assert manager.rejected_count == rejected_count + 1
+
+
+def test_drop_expired_task():
+    m = BGTaskManager(1, [BGTaskLane('bulk', MemoryTaskQueue())], max_queue_age=60)
+    lane = m.lanes[0]
+    result = []
+    m._execute(lane, 'expired', _task, (result,), {}, time.time() - 61)
+    assert result == []
+    assert m.expired_count == 1
+    assert lane.active_count == -1
+
+
+def test_weighted_fair_lanes():
+    m = _create_manager(1, interactive=(3, 0), bulk=(1, 0))
+    result = []
+    for i in range(8):
+        m.put('bulk', ('b%s' % i, _record, (result, 'bulk'), {}, time.time()))
+        m.put('interactive', ('i%s' % i, _record, (result, 'interactive'), {}, time.time()))
+    runner = gevent.spawn(m.run)
+    try:
+        while len(result) < 16:
+            gevent.sleep(0.01)
+    finally:
+        runner.kill()
+    # 两个通道都有任务时按 3:1 执行
+    assert result[:8] == ['interactive'] * 3 + ['bulk'] + ['interactive'] * 3 + ['bulk']
+    stats = m.get_lane_stats(m._lanes['interactive'])
+    assert stats['queue_size'] == 0
+    assert stats['queue_wait_p99'] is not None
+
+
+def test_reserved_workers():
+    m = _create_manager(2, interactive=(1, 1), bulk=(1, 0))
+    result = []
+    event = Event()
+    for i in range(3):
+        m.put('bulk', ('b%s' % i, _record, (result, 'bulk', event), {}, time.time()))
+    runner = gevent.spawn(m.run)
+    try:
+        gevent.sleep(0.05)
+        # 预留给 interactive 的 worker 不会被 bulk 占用
+        assert m._lanes['bulk'].active_count == 1
+        m.put('interactive', ('i', _record, (result, 'interactive'), {}, time.time()))
+        gevent.sleep(0.05)
+        assert result == ['interactive']
+        event.set()
+        gevent.sleep(0.05)
+        assert result == ['interactive'] + ['bulk'] * 3
+    finally:
+        runner.kill()
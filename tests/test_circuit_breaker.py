@@ -0,0 +1,38 @@
+# coding: utf-8
+from smsserver.utils.circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitState
+
+
+def test_open_on_error_rate():
+    breaker = CircuitBreaker(min_requests=4, error_rate=0.5)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.closed
+    breaker.record_failure(is_timeout=True)
+    assert breaker.state == CircuitState.open
+    assert not breaker.is_available()
+    assert breaker.stats()['timeout'] == 1
+
+
+def test_half_open_probe():
+    breaker = CircuitBreaker(min_requests=1, open_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitState.half_open
+
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.half_open
+
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.closed
+    assert breaker.stats()['total'] == 1
+
+
+def test_registry():
+    registry = CircuitBreakerRegistry(min_requests=1)
+    assert registry.get((1, 'sms')) is registry.get((1, 'sms'))
+    registry.get((1, 'sms')).record_failure()
+    assert registry.stats()[(1, 'sms')]['state'] == CircuitState.open
+    assert registry.get((1, 'voice')).is_available()
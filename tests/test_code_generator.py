@@ -0,0 +1,27 @@
+# coding: utf-8
+import string
+from collections import Counter
+from smsserver.utils.code_generator import CodeGenerator
+
+
+def test_generate_batch():
+    pairs = CodeGenerator().generate_batch(1000)
+    assert len(pairs) == 1000
+    assert len(set(serial_number for serial_number, __ in pairs)) == 1000
+    for serial_number, code in pairs:
+        assert len(serial_number) == 16 and set(serial_number) <= set(string.ascii_letters + string.digits)
+        assert len(code) == 6 and code.isdigit()
+
+
+def test_digits_uniform():
+    codes = CodeGenerator(code_length=100).generate_batch(100)
+    counter = Counter(''.join(code for __, code in codes))
+    assert set(counter) == set(string.digits)
+    for n in counter.values():
+        assert 800 < n < 1200
+
+
+def test_pool_refill():
+    generator = CodeGenerator(pool_size=10, refill_ratio=0.5)
+    values = set(generator.get() for i in range(25))
+    assert len(values) == 25
@@ -0,0 +1,85 @@
+# coding: utf-8
+import datetime
+
+import simplejson
+from pytest import fixture, raises
+from smsserver.models import db
+from smsserver.models.const import SMSDeliveryStatus
+from smsserver.models.delivery_report import DeliveryReportIngester
+from smsserver.utils.provider.yunpian import YunPianV1Client
+
+
+class FakeCursor(object):
+    lastrowid = 1
+    rowcount = 2
+
+
+@fixture
+def queries(monkeypatch):
+    queries = []
+
+    def execute_sql(sql, params=None, require_commit=True):
+        queries.append((sql, params))
+        return FakeCursor()
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+    return queries
+
+
+def _report(sid, status='SUCCESS', error_msg=''):
+    return {'sid': sid, 'receive_time': '2016-01-01 10:00:00', 'error_msg': error_msg,
+            'mobile': '100', 'status': status}
+
+
+def test_flush_updates_by_outid(queries):
+    ingester = DeliveryReportIngester()
+    ingester.add(1, [_report('a'), _report('b', 'FAIL', 'DELIVRD_ERR')])
+    ingester.add(1, [_report('a')])
+    ingester.add(2, [_report('c', 'UNKNOWN')])
+    assert ingester.pending_count() == 3
+
+    ingester.flush()
+    assert ingester.pending_count() == 0
+    assert len(queries) == 2
+    for sql, params in queries:
+        assert sql.startswith('UPDATE')
+        assert 'CASE' in sql and '`outid` IN' in sql
+
+    sql, params = [i for i in queries if 'a' in i[1]][0]
+    assert 'error_msg' in sql
+    assert SMSDeliveryStatus.failed in params and 'DELIVRD_ERR' in params
+    assert datetime.datetime(2016, 1, 1, 10) in params
+    sql, params = [i for i in queries if 'c' in i[1]][0]
+    assert 'error_msg' not in sql
+    assert SMSDeliveryStatus.unknown in params
+
+
+def test_flush_failed_keeps_reports(monkeypatch):
+    def execute_sql(sql, params=None, require_commit=True):
+        raise Exception('db error')
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+
+    ingester = DeliveryReportIngester()
+    ingester.add(1, [_report('a')])
+    ingester.add(2, [_report('b')])
+    with raises(Exception):
+        ingester.flush()
+    assert ingester.pending_count() == 2
+
+
+def test_max_pending():
+    ingester = DeliveryReportIngester(max_pending=1)
+    ingester.add(1, [_report('a')])
+    ingester.add(1, [_report('b')])
+    assert ingester.pending_count() == 1
+
+
+def test_yunpian_status_callback():
+    client = YunPianV1Client('apikey')
+    form = {'sms_status': simplejson.dumps([{
+        'sid': 9527, 'uid': None, 'user_receive_time': '2016-01-01 10:00:00', 'error_msg': '',
+        'mobile': '15205201314', 'report_status': 'SUCCESS',
+    }])}
+    assert client.parse_status_callback(form) == [{
+        'sid': '9527', 'receive_time': '2016-01-01 10:00:00', 'error_msg': '',
+        'mobile': '15205201314', 'status': 'SUCCESS',
+    }]
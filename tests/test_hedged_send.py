@@ -0,0 +1,62 @@
+# coding: utf-8
+import gevent
+from pytest import fixture, raises
+from smsserver.models import sms_center
+from smsserver.models.sms_center import SMSSendFailed, _send_hedged
+from smsserver.utils.latency import LatencyTracker
+
+
+class FakeProvider(object):
+
+    def __init__(self, id, delay, ok=True):
+        self.id, self.delay, self.ok = id, delay, ok
+        self.calls = 0
+
+    def send(self, country_code, phone_number, text, service_key, **kw):
+        self.calls += 1
+        gevent.sleep(self.delay)
+        if not self.ok:
+            raise SMSSendFailed('failed')
+        return self.id
+
+
+class FakeExecutionContext(object):
+
+    def execution_context(self, with_transaction=True):
+        return lambda func: func
+
+
+@fixture
+def providers(monkeypatch):
+    providers = []
+    monkeypatch.setattr(sms_center, 'db', FakeExecutionContext())
+    monkeypatch.setattr(sms_center, '_get_weighted_providers', lambda *args: providers)
+    monkeypatch.setattr(sms_center.Config, 'HEDGE_DEFAULT_DELAY', 0.05, raising=False)
+    monkeypatch.setattr(sms_center.Config, 'HEDGE_MAX_EXTRA_SENDS', 1, raising=False)
+    return providers
+
+
+def test_hedge_slow_provider(providers):
+    providers.extend([FakeProvider(1, 1), FakeProvider(2, 0.01), FakeProvider(3, 0)])
+    assert _send_hedged('86', '1', 'text', 'sms') == 2
+    assert providers[2].calls == 0
+
+
+def test_failover_after_failure(providers):
+    providers.extend([FakeProvider(1, 0, ok=False), FakeProvider(2, 0)])
+    assert _send_hedged('86', '1', 'text', 'sms') == 2
+
+
+def test_all_failed(providers):
+    providers.extend([FakeProvider(1, 0, ok=False), FakeProvider(2, 0.1, ok=False)])
+    with raises(SMSSendFailed):
+        _send_hedged('86', '1', 'text', 'sms')
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(size=100)
+    assert tracker.percentile('a', 95) is None
+    for i in range(200):
+        tracker.record('a', i % 100)
+    assert tracker.percentile('a', 95) == 95
+    assert tracker.percentile('a', 50) == 50
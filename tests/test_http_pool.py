@@ -0,0 +1,44 @@
+# coding: utf-8
+import time
+
+import gevent
+from smsserver.utils.provider.pool import SessionPool
+
+
+def test_reuse_session():
+    pool = SessionPool('test', size=2)
+    with pool.session() as s1:
+        pass
+    with pool.session() as s2:
+        assert s2 is s1
+    assert pool.stats()['hit_count'] == 1
+    assert pool.stats()['miss_count'] == 1
+
+
+def test_shared_between_greenlets():
+    pool = SessionPool('test', size=2)
+    sessions = []
+
+    def _use():
+        with pool.session() as session:
+            sessions.append(session)
+            gevent.sleep(0.01)
+
+    gevent.joinall([gevent.spawn(_use) for _ in range(6)])
+    # 同时最多借出 2 个
+    assert len(set(sessions)) == 2
+    stats = pool.stats()
+    assert stats['miss_count'] == 2
+    assert stats['hit_count'] == 4
+    assert stats['idle'] == 2
+    assert stats['in_use'] == 0
+
+
+def test_evict_idle_sessions():
+    pool = SessionPool('test', size=2, idle_timeout=0.01)
+    with pool.session() as s1:
+        pass
+    time.sleep(0.02)
+    with pool.session() as s2:
+        assert s2 is not s1
+    assert pool.stats()['evicted_count'] == 1
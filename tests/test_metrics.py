@@ -0,0 +1,59 @@
+# coding: utf-8
+import pytest
+from smsserver.utils import metrics
+
+
+class FakeStatsClient(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def incr(self, name, count=1):
+        self.sent.append(('incr', name, count))
+
+    def timing(self, name, ms):
+        self.sent.append(('timing', name, ms))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeStatsClient()
+    monkeypatch.setattr(metrics, 'statsd_client', client)
+    monkeypatch.setattr(metrics, 'enabled', True)
+    return client
+
+
+def test_timer_tags(client):
+    with metrics.timer('provider.api_call', provider=1, service_key='sms'):
+        pass
+    kind, name, ms = client.sent[0]
+    assert kind == 'timing'
+    assert name.startswith('provider.api_call,')
+    assert set(name.split(',')[1:]) == {'provider=1', 'service_key=sms'}
+    assert ms >= 0
+
+
+def test_timer_error_tag(client):
+    with pytest.raises(ValueError):
+        with metrics.timer('bgtask.execute', func='f'):
+            raise ValueError
+    assert 'error=ValueError' in client.sent[0][1].split(',')
+
+
+def test_incr(client):
+    metrics.incr('bgtask.rejected', func='f')
+    metrics.incr('delivery_report.received', 3)
+    assert client.sent == [('incr', 'bgtask.rejected,func=f', 1), ('incr', 'delivery_report.received', 3)]
+
+
+def test_disabled(monkeypatch):
+    client = FakeStatsClient()
+    monkeypatch.setattr(metrics, 'statsd_client', client)
+    monkeypatch.setattr(metrics, 'enabled', False)
+    # 不创建新的 timer 对象
+    assert metrics.timer('a', x=1) is metrics.timer('b')
+    with metrics.timer('a', x=1):
+        pass
+    metrics.incr('a')
+    metrics.timing('a', 1)
+    assert client.sent == []
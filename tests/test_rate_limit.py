@@ -0,0 +1,29 @@
+# coding: utf-8
+import time
+from smsserver.utils.rate_limit import MemoryRateLimiter
+
+
+def test_token_bucket(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    limiter = MemoryRateLimiter()
+    assert [limiter.allow('a', 1, 3) for i in range(4)] == [True, True, True, False]
+    assert limiter.allow('b', 1, 3)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 1.5)
+    assert [limiter.allow('a', 1, 3) for i in range(2)] == [True, False]
+
+    monkeypatch.setattr(time, 'time', lambda: now + 100)
+    assert [limiter.allow('a', 1, 3) for i in range(4)] == [True, True, True, False]
+
+
+def test_cleanup(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    limiter = MemoryRateLimiter(cleanup_interval=3)
+    limiter.allow('a', 1, 1)
+    limiter.allow('b', 1, 1)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 10)
+    limiter.allow('c', 1, 1)
+    assert list(limiter._buckets) == ['c']
@@ -0,0 +1,30 @@
+# coding: utf-8
+import time
+from smsserver.utils.recent_providers import MemoryRecentProviderStore
+
+
+def test_add_and_get():
+    store = MemoryRecentProviderStore(window=60)
+    store.add('86', '1', 1)
+    store.add('86', '1', 2)
+    store.add('86', '1', 1)
+    assert sorted(store.get('86', '1')) == [1, 2]
+    assert store.get('86', '2') == []
+    assert store.get('1', '1') == []
+
+
+def test_expire(monkeypatch):
+    store = MemoryRecentProviderStore(window=60, cleanup_interval=2)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    store.add('86', '1', 1)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert store.get('86', '1') == []
+    store.add('86', '2', 1)
+    store.add('86', '3', 1)
+
+    monkeypatch.setattr(time, 'time', lambda: now + 122)
+    store.add('86', '4', 1)
+    store.add('86', '4', 2)
+    assert list(store._data) == [('86', '4')]
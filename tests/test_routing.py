@@ -0,0 +1,52 @@
+# coding: utf-8
+import time
+from pytest import raises
+from smsserver.models.sms_center import OutOfServiceArea, RoutingSnapshot, RoutingTable
+
+
+def _snapshot(ttl=60):
+    areas = {'86': {'sms': (('A', 10), ('B', 1))}}
+    return RoutingSnapshot(areas, time.time() + ttl)
+
+
+def test_snapshot_get_choices():
+    snapshot = _snapshot()
+    assert snapshot.get_choices(' 86 ', 'sms') == (('A', 10), ('B', 1))
+    assert snapshot.get_choices('86', 'voice') == ()
+
+
+def test_snapshot_out_of_service_area():
+    with raises(OutOfServiceArea):
+        _snapshot().get_choices('1', 'sms')
+
+
+def test_routing_table_reload(monkeypatch):
+    table = RoutingTable(60)
+    loads = []
+
+    def _load():
+        loads.append(1)
+        return _snapshot(ttl=table.ttl)
+    monkeypatch.setattr(table, '_load', _load)
+
+    table.get_choices('86', 'sms')
+    table.get_choices('86', 'sms')
+    assert len(loads) == 1
+
+    table.invalidate()
+    table.get_choices('86', 'sms')
+    assert len(loads) == 2
+
+    table.ttl = -1
+    table.invalidate()
+    table.get_choices('86', 'sms')
+    table.get_choices('86', 'sms')
+    assert len(loads) == 4
+
+
+def test_snapshot_sampler_cached():
+    snapshot = _snapshot()
+    sampler = snapshot.get_sampler('86', 'sms')
+    assert snapshot.get_sampler(' 86', 'sms') is sampler
+    assert sampler.choices is snapshot.get_choices('86', 'sms')
+    assert sorted(sampler.shuffle()) == ['A', 'B']
@@ -0,0 +1,58 @@
+# coding: utf-8
+import datetime
+
+from pytest import fixture, raises
+from smsserver.models import db
+from smsserver.models.const import SMSSendStatus
+from smsserver.models.sms_stats import SendStatsAggregator
+
+
+@fixture
+def queries(monkeypatch):
+    queries = []
+
+    def execute_sql(sql, params=None, require_commit=True):
+        queries.append((sql, params))
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+    return queries
+
+
+def test_aggregate_by_hour_and_day(queries):
+    stats = SendStatsAggregator()
+    t = datetime.datetime(2016, 1, 1, 10, 30)
+    stats.add(1, SMSSendStatus.success, '100', t)
+    stats.add(1, SMSSendStatus.success, '100', t + datetime.timedelta(minutes=10))
+    stats.add(1, SMSSendStatus.failed, '100', t)
+    stats.add(2, SMSSendStatus.success, '200', t + datetime.timedelta(hours=1))
+    assert stats.pending_count() == 5
+
+    stats.flush()
+    assert stats.pending_count() == 0
+    assert len(queries) == 2
+
+    hourly_sql, hourly_params = queries[0]
+    assert 'sms_send_hourly_stat' in hourly_sql
+    rows = [tuple(hourly_params[i:i+4]) for i in range(0, len(hourly_params), 4)]
+    hour = datetime.datetime(2016, 1, 1, 10)
+    assert sorted(rows) == sorted([
+        (1, SMSSendStatus.success, hour, 2),
+        (1, SMSSendStatus.failed, hour, 1),
+        (2, SMSSendStatus.success, hour + datetime.timedelta(hours=1), 1),
+    ])
+
+    daily_sql, daily_params = queries[1]
+    assert 'sms_phone_daily_stat' in daily_sql
+    rows = [tuple(daily_params[i:i+3]) for i in range(0, len(daily_params), 3)]
+    assert sorted(rows) == [('100', t.date(), 2), ('200', t.date(), 1)]
+
+
+def test_flush_failed_keeps_counts(monkeypatch):
+    def execute_sql(sql, params=None, require_commit=True):
+        raise Exception('db error')
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+
+    stats = SendStatsAggregator()
+    stats.add(1, SMSSendStatus.success, '100', datetime.datetime(2016, 1, 1, 10, 30))
+    with raises(Exception):
+        stats.flush()
+    assert stats.pending_count() == 2
@@ -0,0 +1,86 @@
+# coding: utf-8
+import re
+
+import simplejson
+from pytest import raises
+from smsserver.utils.provider.alidayu import ALiDaYuClient
+from smsserver.utils.provider.base import SMSSendFailed
+from smsserver.utils.provider.templates import CombinedMatcher, TemplateRegistry
+from smsserver.utils.provider.yunpian import YunPianV1Client
+
+TEMPLATES = {
+    'code': {
+        'text': u'验证码：%(code)s，请在%(minutes)s分钟内完成验证。',
+        'yunpian': {'tpl_id': 1},
+        'alidayu': {
+            'sms': {'template_code': 'SMS_1', 'params': ('code',)},
+            'voice': {'template_code': 'TTS_1', 'params': ('code',), 'to_chinese': ('code',)},
+        },
+    },
+    'notice': {'text': u'%(name)s 你好'},
+}
+
+ALIDAYU_TEMPLATES = {
+    'sms': {'templates': (
+        {'regex': re.compile(u'订单(\\d+)已发货'), 'params': u'{"order":"%s"}', 'template_code': 'SMS_2'},
+        {'regex': re.compile(u'验证码：(\\d+)'), 'params': u'{"code":"%s"}', 'template_code': 'SMS_1'},
+        {'regex': re.compile(u'(\\d+)'), 'params': u'{"number":"%s"}', 'template_code': 'SMS_3'},
+    )},
+    'voice': {'templates': (
+        {'regex': re.compile(u'验证码：(\\d+)'), 'params': u'{"code":"%s"}', 'template_code': 'TTS_1',
+         'to_chinese': True},
+    )},
+}
+
+registry = TemplateRegistry(TEMPLATES)
+
+
+def test_render():
+    assert registry.get('code').render({'code': '1234', 'minutes': 30}) == u'验证码：1234，请在30分钟内完成验证。'
+    assert 'notice' in registry
+    with raises(SMSSendFailed):
+        registry.get('missing')
+    with raises(SMSSendFailed):
+        registry.get('notice').render({})
+
+
+def test_combined_matcher_keeps_order():
+    matcher = CombinedMatcher(ALIDAYU_TEMPLATES['sms']['templates'])
+    # 第三个模板在更靠前的位置能匹配，但按配置顺序应该选第二个
+    template, groups = matcher.match(u'9 验证码：1234')
+    assert template['template_code'] == 'SMS_1'
+    assert groups == ('1234',)
+    template, groups = matcher.match(u'abc 42')
+    assert template['template_code'] == 'SMS_3'
+    assert groups == ('42',)
+    assert matcher.match(u'无数字') == (None, None)
+
+
+def test_alidayu_text_and_template_map():
+    client = ALiDaYuClient('key', 'secret', ALIDAYU_TEMPLATES, '')
+    assert client._text_map(u'验证码：1234，请在30分钟内完成验证。', 'sms', 'sms_template_code', 'sms_param') == {
+        'sms_template_code': 'SMS_1', 'sms_param': u'{"code":"1234"}'}
+    assert client._text_map(u'验证码：12', 'voice', 'tts_code', 'tts_param') == {
+        'tts_code': 'TTS_1', 'tts_param': u'{"code":"一二"}'}
+
+    data = client._template_map(registry.get('code'), {'code': '12', 'minutes': 30}, 'voice', 'tts_code', 'tts_param')
+    assert data['tts_code'] == 'TTS_1'
+    assert simplejson.loads(data['tts_param']) == {'code': u'一二'}
+
+    # 没有配置阿里大于模板时按文本匹配
+    with raises(SMSSendFailed):
+        client._template_map(registry.get('notice'), {'name': u'张三'}, 'sms', 'sms_template_code', 'sms_param')
+
+
+def test_yunpian_template_fallback(monkeypatch):
+    client = YunPianV1Client('apikey')
+    calls = []
+    monkeypatch.setattr(client, 'send_sms', lambda *args: calls.append(('send_sms',) + args))
+    monkeypatch.setattr(client, 'tpl_send', lambda *args: calls.append(('tpl_send',) + args))
+
+    client.send_template_sms('86', '100', registry.get('code'), {'code': '1234', 'minutes': 30})
+    client.send_template_sms('86', '100', registry.get('notice'), {'name': u'张三'})
+    assert calls == [
+        ('tpl_send', '86', '100', 1, {'code': '1234', 'minutes': 30}),
+        ('send_sms', '86', '100', u'张三 你好'),
+    ]
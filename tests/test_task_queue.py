@@ -0,0 +1,47 @@
+# coding: utf-8
+from pytest import fixture
+from smsserver.utils.task_queue import MemoryTaskQueue, SQLiteTaskQueue, dumps_task, loads_task
+
+
+def _task(*args, **kw):
+    pass
+
+
+@fixture(params=['memory', 'sqlite'])
+def queue(request, tmpdir):
+    if request.param == 'sqlite':
+        return SQLiteTaskQueue(str(tmpdir.join('bgtask.db')))
+    return MemoryTaskQueue()
+
+
+def test_dumps_and_loads_task():
+    task = ('id', _task, (1, u'文本'), {'a': [1, 2]}, 1500000000.5)
+    assert loads_task(dumps_task(task)) == task
+
+
+def test_get_batch(queue):
+    for i in range(5):
+        queue.put((str(i), _task, (i,), {}, 0))
+    assert queue.qsize() == 5
+
+    tasks = queue.get_batch(3, timeout=0)
+    assert [i[0] for i in tasks] == ['0', '1', '2']
+    assert [i[0] for i in queue.get_batch(3, timeout=0)] == ['3', '4']
+    assert queue.get_batch(3, timeout=0) == []
+
+
+def test_sqlite_redeliver_unacked_task(tmpdir):
+    path = str(tmpdir.join('bgtask.db'))
+    queue = SQLiteTaskQueue(path, lease_seconds=-1)
+    queue.put(('a', _task, (), {}, 0))
+    queue.put(('b', _task, (), {}, 0))
+
+    assert len(queue.get_batch(2, timeout=0)) == 2
+    queue.ack('a')
+
+    # 模拟重启
+    queue = SQLiteTaskQueue(path, lease_seconds=60)
+    assert queue.recover() == 1
+    assert queue.qsize() == 1
+    assert [i[0] for i in queue.get_batch(2, timeout=0)] == ['b']
+    assert queue.get_batch(2, timeout=0) == []
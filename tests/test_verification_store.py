@@ -0,0 +1,42 @@
+# coding: utf-8
+from pytest import fixture
+from smsserver.models.sms_verification import VERIFY_TIMES_LIMIT
+from smsserver.models.verification_store import HotVerificationStore, MemoryVerificationKV
+
+COUNTRY_CODE = '86'
+PHONE_NUMBER = '18510238421'
+
+
+@fixture
+def store():
+    return HotVerificationStore(MemoryVerificationKV())
+
+
+def test_reuse_verification(store):
+    obj = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER)
+    reused = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER)
+    assert (reused.code, reused.serial_number) == (obj.code, obj.serial_number)
+    assert reused.expire_time >= obj.expire_time
+
+    other = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER + '1')
+    assert other.serial_number != obj.serial_number
+
+
+def test_verify(store):
+    obj = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER)
+    assert not store.verify(COUNTRY_CODE + '1', PHONE_NUMBER, obj.code)
+    assert not store.verify(COUNTRY_CODE, PHONE_NUMBER, obj.code + '1')
+    assert store.verify(COUNTRY_CODE, PHONE_NUMBER, obj.code)
+    # 验证码只能使用一次
+    assert not store.verify(COUNTRY_CODE, PHONE_NUMBER, obj.code)
+
+
+def test_verify_times_limit(store):
+    obj = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER)
+    for i in range(VERIFY_TIMES_LIMIT):
+        assert not store.verify(COUNTRY_CODE, PHONE_NUMBER, obj.code + '1')
+    assert not store.verify(COUNTRY_CODE, PHONE_NUMBER, obj.code)
+
+    new_obj = store.create_or_get_unused_verification_code(COUNTRY_CODE, PHONE_NUMBER)
+    assert new_obj.serial_number != obj.serial_number
+    assert store.verify(COUNTRY_CODE, PHONE_NUMBER, new_obj.code)
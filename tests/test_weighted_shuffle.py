@@ -1,54 +1,96 @@
 # coding: utf-8
-from pytest import approx, mark
-from smsserver.utils.weighted_shuffle import weighted_shuffle
+import random
+from collections import Counter
 
+from pytest import fixture, mark
+from smsserver.utils.weighted_shuffle import WeightedSampler, weighted_shuffle
 
-@mark.parametrize('choices', [
+N = 20000
+# 卡方分布 p=0.001 的临界值，按自由度
+CHI_SQUARE_CRITICAL = {1: 10.83, 2: 13.82, 3: 16.27, 4: 18.47}
+
+CHOICES = [
     [('A', 1)],
-    [
-        ('A', 1),
-        ('B', 2),
-    ],
-    [
-        ('C', 3),
-        ('B', 2),
-        ('A', 1),
-    ],
-])
+    [('A', 1), ('B', 2)],
+    [('C', 3), ('B', 2), ('A', 1)],
+    [('A', 0.001), ('B', 5), ('C', 1), ('D', 1)],
+]
+
+
+@fixture(autouse=True)
+def seed():
+    state = random.getstate()
+    random.seed(20160101)
+    yield
+    random.setstate(state)
+
+
+def _assert_distribution(counter, expect):
+    """卡方检验，expect 为 {key: 概率}"""
+    assert set(counter) <= set(expect)
+    if len(expect) == 1:
+        return
+    chi_square = sum((counter[k] - N * p) ** 2 / (N * p) for k, p in expect.items())
+    assert chi_square < CHI_SQUARE_CRITICAL[len(expect) - 1]
+
+
+def _first_expect(choices):
+    total = float(sum(w for __, w in choices))
+    return {k: w / total for k, w in choices}
+
+
+@mark.parametrize('choices', CHOICES)
 def test_weighted_shuffle(choices):
-    total = sum([w for __, w in choices])
-    expect = {k: w/float(total) for k, w in choices}
+    counter = Counter(weighted_shuffle(choices)[0] for i in range(N))
+    _assert_distribution(counter, _first_expect(choices))
+
+
+@mark.parametrize('choices', CHOICES)
+def test_sampler(choices):
+    sampler = WeightedSampler(choices)
+    expect = _first_expect(choices)
+    _assert_distribution(Counter(sampler.shuffle()[0] for i in range(N)), expect)
+    _assert_distribution(Counter(sampler.choice() for i in range(N)), expect)
 
-    N = 10**6
-    result = {k: 0 for k, __ in choices}
-    for i in range(N):
-        key = list(weighted_shuffle(choices))[0]
-        result[key] += 1
-    result = {k: v/float(N) for k, v in result.items()}
 
-    for k in expect:
-        assert result[k] == approx(expect[k], rel=1e-2)
+def test_second_position():
+    """第一个取走后，按剩余元素的权重抽取第二个"""
+    choices = [('A', 3), ('B', 2), ('C', 1)]
+    counter = Counter(tuple(weighted_shuffle(choices)[:2]) for i in range(N))
+    # 条件概率 P(B|A 在第一个) = 2/3
+    first_a = sum(v for k, v in counter.items() if k[0] == 'A')
+    second = Counter({k[1]: v for k, v in counter.items() if k[0] == 'A'})
+    chi_square = sum((second[k] - first_a * p) ** 2 / (first_a * p) for k, p in (('B', 2 / 3.0), ('C', 1 / 3.0)))
+    assert chi_square < CHI_SQUARE_CRITICAL[1]
 
 
 def test_weighted_shuffle_empty():
     assert weighted_shuffle([]) == []
+    assert WeightedSampler([]).shuffle() == []
+    assert WeightedSampler([]).choice() is None
 
 
 def test_weighted_shuffle_balance():
     """权重相同时，任何元素在任何位置的概率都应当是一样的"""
-    choices = [
-        ('A', 1),
-        ('B', 1),
-        ('C', 1),
-        ('D', 1),
-        ('E', 1),
-    ]
-    N = 10**6
-    result = {k: [0]*len(choices) for k, __ in choices}
+    choices = [('A', 1), ('B', 1), ('C', 1), ('D', 1), ('E', 1)]
+    positions = {k: Counter() for k, __ in choices}
     for i in range(N):
-        items = weighted_shuffle(choices)
-        for i, k in enumerate(items):
-            result[k][i] += 1
-    for k in result:
-        for n in result[k]:
-            assert n/float(N) == approx(1.0/len(choices), rel=1e-2)
+        for position, k in enumerate(weighted_shuffle(choices)):
+            positions[k][position] += 1
+    for k in positions:
+        _assert_distribution(positions[k], {i: 1.0 / len(choices) for i in range(len(choices))})
+
+
+def test_zero_weight_last():
+    choices = [('A', 0), ('B', 1), ('C', 0)]
+    for i in range(100):
+        result = weighted_shuffle(choices)
+        assert result[0] == 'B' and set(result[1:]) == {'A', 'C'}
+        assert WeightedSampler(choices).shuffle()[0] == 'B'
+
+
+def test_choices_not_modified():
+    choices = [('A', 1), ('B', 2), ('C', 3)]
+    weighted_shuffle(choices)
+    WeightedSampler(choices).shuffle()
+    assert choices == [('A', 1), ('B', 2), ('C', 3)]
@@ -0,0 +1,54 @@
+# coding: utf-8
+from pytest import fixture
+from smsserver.models import db
+from smsserver.models.sms_center import SMSRecord
+from smsserver.models.write_behind import WriteBehindWriter
+
+
+class FakeCursor(object):
+    lastrowid = 1
+    rowcount = 1
+
+
+@fixture
+def queries(monkeypatch):
+    queries = []
+
+    def execute_sql(sql, params=None, require_commit=True):
+        queries.append((sql, params))
+        return FakeCursor()
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+    return queries
+
+
+def test_batch_inserts_and_updates(queries):
+    writer = WriteBehindWriter(SMSRecord, batch_size=2)
+    for i in range(3):
+        writer.add(SMSRecord(country_code='86', phone_number=str(i), text='text', provider_id=1))
+    writer.update([1, 2], status=1)
+    writer.update([3], status=1)
+    writer.update([4], status=2)
+    assert writer.pending_count() == 7
+    assert writer._event.is_set()
+
+    writer.flush()
+    assert writer.pending_count() == 0
+    inserts = [i for i in queries if i[0].startswith('INSERT')]
+    updates = [i for i in queries if i[0].startswith('UPDATE')]
+    assert len(inserts) == 2
+    assert len(updates) == 3
+
+
+def test_restore_on_failure(monkeypatch):
+    def execute_sql(sql, params=None, require_commit=True):
+        raise IOError
+    monkeypatch.setattr(db, 'execute_sql', execute_sql)
+
+    writer = WriteBehindWriter(SMSRecord, batch_size=2)
+    writer.add(SMSRecord(country_code='86', phone_number='1', text='text', provider_id=1))
+    writer.update([1], status=1)
+    try:
+        writer.flush()
+    except IOError:
+        pass
+    assert writer.pending_count() == 2